@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests_toolbelt import MultipartEncoder
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+MIME_TYPES = {
+    '.png': 'image/png',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.gif': 'image/gif',
+    '.pdf': 'application/pdf',
+    '.log': 'text/x-log',
+    '.bin': 'application/octet-stream',
+    '.txt': 'text/plain',
+    '.zip': 'application/zip',
+    '.diff': 'text/x-patch',
+    '.ico': 'image/x-icon'
+}
+
+
+def buffer_file(fileobj: IO[bytes], size: int,
+                memory_limit: int) -> Union[bytes, IO[bytes]]:
+    """
+    Reads a file that is only readable once, like a member of a streamed
+    tar archive. Small files are kept in memory, bigger ones are copied
+    into an anonymous temporary file.
+    """
+    if size <= memory_limit:
+        return fileobj.read()
+    tmp = tempfile.TemporaryFile()
+    shutil.copyfileobj(fileobj, tmp, 1024 * 1024)
+    tmp.seek(0)
+    return tmp
+
+
+class AssetUploader:
+    """
+    Uploads files to the /u endpoint of wikijs on a bounded pool of
+    threads sharing one keep-alive session. The request bodies are
+    streamed and failed uploads are retried with a backoff.
+    """
+
+    def __init__(self,
+                 url: str,
+                 token: str,
+                 folder_id: int,
+                 concurrency: int = 4,
+                 retries: int = 3) -> None:
+        self.url = url
+        self.folder_id = folder_id
+        self.retries = retries
+        self.failed = 0
+        self.session = requests.Session()
+        self.session.headers['Authorization'] = f'Bearer {token}'
+        adapter = HTTPAdapter(pool_connections=concurrency,
+                              pool_maxsize=concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+        # Bounds the buffered files to the running and the queued uploads
+        self._slots = threading.BoundedSemaphore(concurrency * 2)
+        self._lock = threading.Lock()
+
+    def submit(self, filename: str, body: Union[bytes, IO[bytes]]):
+        self._slots.acquire()
+        future = self._executor.submit(self._upload, filename, body)
+        future.add_done_callback(lambda _: self._slots.release())
+
+    def _upload(self, filename: str, body: Union[bytes, IO[bytes]]):
+        try:
+            for attempt in range(self.retries + 1):
+                if attempt:
+                    time.sleep(2**attempt)
+                if not isinstance(body, bytes):
+                    body.seek(0)
+                encoder = MultipartEncoder(fields=[
+                    ('mediaUpload', '{"folderId": %i}' % self.folder_id),
+                    ('mediaUpload',
+                     (filename, body,
+                      MIME_TYPES.get(
+                          os.path.splitext(filename)[1].lower(),
+                          'text/plain'))),
+                ])
+                try:
+                    with metrics.timed('asset_upload'):
+                        r = self.session.post(
+                            self.url,
+                            data=encoder,
+                            headers={'Content-Type': encoder.content_type})
+                except requests.RequestException as e:
+                    logger.warning(f'Uploading {filename} failed: {e}')
+                    continue
+                if r.status_code == 200:
+                    logger.info(f'Uploaded file {filename}.')
+                    metrics.count('assets_uploaded')
+                    metrics.count('asset_bytes', encoder.len)
+                    return
+                logger.warning(
+                    f'Uploading {filename} failed with status {r.status_code}')
+            logger.warning(f'Failed to upload {filename}!')
+            metrics.count('asset_upload_failures')
+            with self._lock:
+                self.failed += 1
+        finally:
+            if not isinstance(body, bytes):
+                body.close()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self.session.close()
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, List, Optional
+
+import synthetic_dump
+
+STAGES = [
+    'read_dump', 'convert_content', 'fix_hyper_links', 'import_users',
+    'migrate', 'migrate_assets'
+]
+
+BUILD_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class LocalPostgres:
+    """
+    A throwaway postgres cluster in a temporary directory, with a wiki
+    database owned by the wikijs user the migration connects as. initdb
+    refuses to run as root, so the benchmark has to run as another user.
+    """
+
+    def __init__(self, directory: str, bin_dir: Optional[str] = None) -> None:
+        self.directory = directory
+        self.bin_dir = bin_dir
+        self.port = free_port()
+
+    @staticmethod
+    def available(bin_dir: Optional[str] = None) -> bool:
+        return (os.geteuid() != 0 and
+                shutil.which('initdb', path=bin_dir) is not None and
+                shutil.which('pg_ctl', path=bin_dir) is not None)
+
+    @property
+    def conninfo(self) -> str:
+        return f'host=127.0.0.1 port={self.port} dbname=wiki user=wikijs'
+
+    def _run(self, *args: str):
+        subprocess.run([shutil.which(args[0], path=self.bin_dir), *args[1:]],
+                       check=True,
+                       stdout=subprocess.DEVNULL)
+
+    def __enter__(self) -> 'LocalPostgres':
+        data = os.path.join(self.directory, 'data')
+        self._run('initdb', '-D', data, '-U', 'wikijs', '--auth=trust',
+                  '-E', 'UTF8')
+        self._run('pg_ctl', '-D', data, '-l',
+                  os.path.join(self.directory, 'postgres.log'), '-o',
+                  f'-p {self.port} -k {self.directory} '
+                  '-c listen_addresses=127.0.0.1 -c fsync=off', '-w', 'start')
+        import psycopg as psql
+        with psql.connect(f'host=127.0.0.1 port={self.port} dbname=postgres '
+                          'user=wikijs',
+                          autocommit=True) as conn:
+            conn.execute('CREATE DATABASE wiki')
+        return self
+
+    def __exit__(self, *exc):
+        self._run('pg_ctl', '-D', os.path.join(self.directory, 'data'), '-m',
+                  'fast', '-w', 'stop')
+
+
+@contextmanager
+def stub_server(port: int, latency: float, conninfo: Optional[str],
+                log_file: str):
+    args = [
+        sys.executable,
+        os.path.join(BUILD_DIR, 'stub_wikijs.py'), '--port',
+        str(port), '--latency',
+        str(latency)
+    ]
+    if conninfo:
+        args += ['--psql', conninfo]
+    with open(log_file, 'w') as log:
+        process = subprocess.Popen(args, stdout=log, stderr=log)
+    try:
+        for _ in range(100):
+            try:
+                urllib.request.urlopen(f'http://127.0.0.1:{port}/', timeout=1)
+                break
+            except OSError:
+                if process.poll() is not None:
+                    raise RuntimeError(f'The stub wikijs exited, see {log_file}')
+                time.sleep(0.1)
+        yield
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def offline_migration(asset_archive: str):
+    """
+    Creates the migration with the mediawiki ssh host replaced by local
+    files and the wikijs database by the local postgres. It's created in
+    the stage process, because query_defs fetches the schema of wikijs on
+    import.
+    """
+    from mediawiki2wikijs import MediawikiMigration
+    from constants import WIKIJS_HOST, WIKIJS_TOKEN
+
+    class OfflineMigration(MediawikiMigration):
+
+        @contextmanager
+        def open_asset_archive(self):
+            with open(asset_archive, 'rb') as f:
+                yield f
+
+        @property
+        def sql_client(self):
+            if self._sql_client is None:
+                import psycopg as psql
+                self._sql_client = psql.connect(os.environ['BENCHMARK_PSQL'])
+            return self._sql_client
+
+    return OfflineMigration(None, None, None, WIKIJS_HOST, WIKIJS_TOKEN)
+
+
+def run_stage(stage: str, workdir: str) -> Dict:
+    """
+    Runs a single stage and returns the time it took and the number of
+    processed items and bytes. Creating the migration isn't timed. The
+    stages share the files in workdir, e.g. fix_hyper_links rewrites the
+    markdown written by convert_content.
+    """
+    import metrics
+    from constants import (DUMP_INDEX, DUMP_REVISIONS, PANDOC_BATCH_SIZE,
+                           PANDOC_WORKERS, WIKI_XML_LOCATION)
+    converted_file = os.path.join(workdir, 'converted.json')
+    asset_archive = os.path.join(workdir, 'assets.tar')
+    result = {}
+
+    def timed(function: Callable, *args):
+        started = time.perf_counter()
+        value = function(*args)
+        result['seconds'] = time.perf_counter() - started
+        return value
+
+    if stage == 'read_dump':
+        for path in (DUMP_INDEX, DUMP_REVISIONS):
+            if os.path.exists(path):
+                os.remove(path)
+        migration = offline_migration(asset_archive)
+        store = timed(migration.read_dump, WIKI_XML_LOCATION)
+        result.update(items=len(store), unit='revisions',
+                      bytes=os.path.getsize(WIKI_XML_LOCATION))
+
+    elif stage == 'convert_content':
+        from converter import ContentConverter
+        from dump_store import DumpStore
+        from fix_links import strip_link_pipes
+        store = DumpStore(DUMP_INDEX, DUMP_REVISIONS)
+        engine = ContentConverter(workers=PANDOC_WORKERS,
+                                  batch_size=PANDOC_BATCH_SIZE)
+        converted = timed(lambda: list(engine.imap(
+            strip_link_pipes(entry.content)
+            for _, data in store.pages() for entry in data)))
+        with open(converted_file, 'w') as f:
+            json.dump([markdown or '' for _, markdown in converted], f)
+        result.update(items=len(converted), unit='revisions',
+                      bytes=sum(len(content.encode('utf-8'))
+                                for content, _ in converted))
+
+    elif stage == 'fix_hyper_links':
+        from fix_links import fix_hyper_links_many
+        with open(converted_file) as f:
+            converted = json.load(f)
+        timed(lambda: fix_hyper_links_many(converted))
+        result.update(items=len(converted), unit='documents',
+                      bytes=sum(len(md.encode('utf-8')) for md in converted))
+
+    elif stage == 'import_users':
+        migration = offline_migration(asset_archive)
+        timed(migration.import_users_from_wiki)
+        result.update(items=len(migration.page_dump.contributors()),
+                      unit='users')
+
+    elif stage == 'migrate':
+        migration = offline_migration(asset_archive)
+        timed(migration.migrate)
+        result.update(items=metrics.REGISTRY.counters.get('revisions_pushed', 0),
+                      unit='revisions')
+
+    elif stage == 'migrate_assets':
+        migration = offline_migration(asset_archive)
+        timed(migration.migrate_assets)
+        result.update(items=metrics.REGISTRY.counters.get('assets_uploaded', 0),
+                      unit='assets',
+                      bytes=metrics.REGISTRY.counters.get('asset_bytes', 0))
+
+    else:
+        raise ValueError(f'Unknown stage {stage}')
+    return result
+
+
+def stage_main(stage: str, workdir: str, result_file: str):
+    import metrics
+    result = run_stage(stage, workdir)
+    # ru_maxrss is in KiB on Linux
+    result['peak_rss'] = resource.getrusage(
+        resource.RUSAGE_SELF).ru_maxrss * 1024
+    result['peak_rss_children'] = resource.getrusage(
+        resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+    result['metrics'] = metrics.REGISTRY.to_dict()
+    with open(result_file, 'w') as f:
+        json.dump(result, f, indent=2)
+
+
+def format_result(stage: str, result: Dict) -> str:
+    seconds = result['seconds']
+    throughput = f"{result['items'] / seconds:10.1f} {result['unit']}/s"
+    if result.get('bytes'):
+        throughput += f" {result['bytes'] / seconds / 1024 / 1024:8.2f} MB/s"
+    return (f"{stage:<16} {seconds:9.2f}s {throughput:<40} "
+            f"{result['peak_rss'] / 1024 / 1024:8.1f} MB "
+            f"{result['peak_rss_children'] / 1024 / 1024:8.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmarks the migration offline against a synthetic '
+        'dump, a stub wikijs and a throwaway postgres.')
+    parser.add_argument('--stages', default=','.join(STAGES),
+                        help='comma separated stages to run, in this order')
+    parser.add_argument('--workdir', default=None,
+                        help='directory for the dump, the databases and the '
+                        'results, a temporary one by default')
+    parser.add_argument('--pages', type=int, default=200)
+    parser.add_argument('--revisions', type=int, default=3)
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--text-size', type=int, default=2000)
+    parser.add_argument('--tables', type=int, default=1)
+    parser.add_argument('--links', type=int, default=5)
+    parser.add_argument('--images', type=int, default=1)
+    parser.add_argument('--image-count', type=int, default=50)
+    parser.add_argument('--image-size', type=int, default=64 * 1024)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--latency', type=float, default=0.005,
+                        help='seconds every request to the stub wikijs takes')
+    parser.add_argument('--pg-bin', default=os.environ.get('PG_BIN'),
+                        help='directory of initdb and pg_ctl')
+    parser.add_argument('--run-stage', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--result', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_stage:
+        return stage_main(args.run_stage, args.workdir, args.result)
+
+    stages: List[str] = args.stages.split(',')
+    for stage in stages:
+        if stage not in STAGES:
+            parser.error(f'Unknown stage {stage}')
+
+    workdir = os.path.abspath(args.workdir or
+                              tempfile.mkdtemp(prefix='mw2wjs-benchmark-'))
+    data_dir = os.path.join(workdir, 'data')
+    os.makedirs(data_dir, exist_ok=True)
+    with open(os.path.join(workdir, 'username_mapping.json'), 'w') as f:
+        f.write('{}')
+
+    started = time.perf_counter()
+    revisions = synthetic_dump.write_dump(os.path.join(data_dir, 'wiki.xml'),
+                                          args.pages,
+                                          args.revisions,
+                                          args.users,
+                                          args.seed,
+                                          text_size=args.text_size,
+                                          tables=args.tables,
+                                          links=args.links,
+                                          images=args.images,
+                                          image_count=args.image_count)
+    synthetic_dump.write_asset_archive(os.path.join(workdir, 'assets.tar'),
+                                       args.image_count, args.image_size,
+                                       args.seed)
+    print(f'Generated {args.pages} pages with {revisions} revisions in '
+          f'{time.perf_counter() - started:.1f}s ({workdir}).')
+
+    postgres = None
+    if LocalPostgres.available(args.pg_bin):
+        postgres = LocalPostgres(os.path.join(workdir, 'postgres'),
+                                 args.pg_bin)
+    elif 'migrate' in stages:
+        print("initdb isn't available or the benchmark runs as root, "
+              "skipping the migrate stage.")
+        stages.remove('migrate')
+
+    port = free_port()
+    env = dict(os.environ,
+               DATA_DIR=data_dir,
+               WIKIJS_HOST=f'http://127.0.0.1:{port}',
+               WIKIJS_TOKEN='benchmark',
+               LOCALE=os.environ.get('LOCALE') or 'en')
+    if postgres is not None:
+        os.makedirs(postgres.directory)
+        env.update(BENCHMARK_PSQL=postgres.conninfo)
+
+    results = {}
+    with postgres or nullcontext():
+        with stub_server(port, args.latency,
+                         postgres.conninfo if postgres else None,
+                         os.path.join(workdir, 'stub_wikijs.log')):
+            print(f"{'stage':<16} {'time':>10} {'throughput':<40} "
+                  f"{'peak RSS':>11} {'child RSS':>11}")
+            for stage in stages:
+                result_file = os.path.join(workdir, f'{stage}.json')
+                log_file = os.path.join(workdir, f'{stage}.log')
+                with open(log_file, 'w') as log:
+                    exitcode = subprocess.call([
+                        sys.executable,
+                        os.path.abspath(__file__), '--run-stage', stage,
+                        '--workdir', workdir, '--result', result_file
+                    ],
+                                               cwd=workdir,
+                                               env=env,
+                                               stdout=log,
+                                               stderr=subprocess.STDOUT)
+                if exitcode != 0:
+                    print(f'{stage} failed, see {log_file}')
+                    break
+                with open(result_file) as f:
+                    results[stage] = json.load(f)
+                print(format_result(stage, results[stage]))
+
+    with open(os.path.join(workdir, 'benchmark.json'), 'w') as f:
+        json.dump({'options': vars(args), 'results': results}, f, indent=2)
+    print(f"Wrote the results to {os.path.join(workdir, 'benchmark.json')}.")
+
+
+if __name__ == '__main__':
+    main()
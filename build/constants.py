@@ -23,13 +23,30 @@ MEDIAWIKI_ASSETS             = os.environ.get("MEDIAWIKI_ASSETS")
 USER_TIMEZONE                = os.environ.get("USER_TIMEZONE")
 LDAP_USER_GROUP_REDIRECT_URI = os.environ.get("LDAP_USER_GROUP_REDIRECT_URI")
 LOCALE                       = os.environ.get("LOCALE")
+PANDOC_WORKERS               = int(os.environ.get("PANDOC_WORKERS") or os.cpu_count() or 1)
+PANDOC_BATCH_SIZE            = int(os.environ.get("PANDOC_BATCH_SIZE") or 50)
+CONVERSION_CACHE_SIZE        = int(os.environ.get("CONVERSION_CACHE_SIZE") or 1024) * 1024 * 1024
+SKIP_UNCHANGED_REVISIONS     = os.environ.get("SKIP_UNCHANGED_REVISIONS") or "false"
+GRAPHQL_BATCH_SIZE           = int(os.environ.get("GRAPHQL_BATCH_SIZE") or 50)
+GRAPHQL_CONCURRENCY          = int(os.environ.get("GRAPHQL_CONCURRENCY") or 4)
+SQL_BATCH_SIZE               = int(os.environ.get("SQL_BATCH_SIZE") or 200)
+ASSET_UPLOAD_CONCURRENCY     = int(os.environ.get("ASSET_UPLOAD_CONCURRENCY") or 4)
+ASSET_MEMORY_LIMIT           = 8 * 1024 * 1024
+INCREMENTAL                  = os.environ.get("INCREMENTAL") or "false"
+PROFILE_STAGE                = os.environ.get("PROFILE_STAGE")
+DATA_DIR                     = os.environ.get("DATA_DIR") or "/data"
 
-WIKI_XML_LOCATION = "/data/wiki.xml"
-WIKI_MD_DIR       = "/data/wiki-md"
-WIKI_TXT_DIR      = "/data/wiki-txt"
-MIGRATION_LOG     = "/data/wiki-migration.log"
-ERR_PAGES_LOG     = "/data/err-pages.log"
-WIKI_IMG_LOCATION = "/data/wiki-img.tar.gz"
+WIKI_XML_LOCATION = f"{DATA_DIR}/wiki.xml"
+WIKI_MD_DIR       = f"{DATA_DIR}/wiki-md"
+WIKI_TXT_DIR      = f"{DATA_DIR}/wiki-txt"
+MIGRATION_LOG     = f"{DATA_DIR}/wiki-migration.log"
+ERR_PAGES_LOG     = f"{DATA_DIR}/err-pages.log"
 ASSET_FOLDER      = "assets"
-DUMP_OBJ          = "/data/dump.bin"
+DUMP_INDEX        = f"{DATA_DIR}/dump-index.sqlite"
+DUMP_REVISIONS    = f"{DATA_DIR}/dump-revisions.bin"
+CONVERSION_CACHE  = f"{DATA_DIR}/conversion-cache"
+JOURNAL           = f"{DATA_DIR}/migration-journal.sqlite"
+METRICS_JSON      = f"{DATA_DIR}/migration-metrics.json"
+METRICS_PROM      = f"{DATA_DIR}/migration-metrics.prom"
+PROFILE_FILE      = f"{DATA_DIR}/profile-%s.prof"
 
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+import hashlib
+import os
+import threading
+import zlib
+from typing import Optional
+
+
+class ConversionCache:
+    """
+    On-disk cache of converted markdown, keyed by the hash of the wikitext
+    and the converter version. When the cache grows beyond max_size bytes
+    the least recently used entries are evicted.
+    """
+
+    def __init__(self, directory: str, max_size: int, version: str) -> None:
+        self.directory = directory
+        self.max_size = max_size
+        self.version = version
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(entry[2] for entry in self._entries())
+
+    def _entries(self):
+        for base, _, files in os.walk(self.directory):
+            for filename in files:
+                # Entries that are still being written by put
+                if filename.endswith('.tmp'):
+                    continue
+                path = os.path.join(base, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat.st_mtime_ns, stat.st_size
+
+    def _path(self, content: str) -> str:
+        key = hashlib.sha256(
+            f'{self.version}\0{content}'.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, content: str) -> Optional[str]:
+        path = self._path(content)
+        try:
+            with open(path, 'rb') as f:
+                markdown = zlib.decompress(f.read()).decode('utf-8')
+        except (FileNotFoundError, zlib.error):
+            return None
+        # Keep the modification time as the last use for the eviction
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Evicted by another thread since it was read
+            pass
+        return markdown
+
+    def put(self, content: str, markdown: str):
+        path = self._path(content)
+        body = zlib.compress(markdown.encode('utf-8'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(body)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._size += len(body)
+            if self._size > self.max_size:
+                self._evict()
+
+    def _evict(self):
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        self._size = sum(entry[2] for entry in entries)
+        # Evict down to 90% so this doesn't run on every single put
+        target = self.max_size * 0.9
+        for path, _, size in entries:
+            if self._size <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._size -= size
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+import logging
+import os
+import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from subprocess import PIPE, Popen, check_output
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Tuple
+from uuid import uuid4
+from conversion_cache import ConversionCache
+import metrics
+
+logger = logging.getLogger(__name__)
+
+PANDOC_ARGS = [
+    'pandoc', '-f', 'mediawiki', '-t', 'gfm', '-o', '/dev/stdout',
+    '--wrap=none'
+]
+
+# Bump this whenever the conversion or the postprocessing changes its
+# output, so cached conversions aren't reused.
+CONVERTER_VERSION = 2
+
+
+def converter_version() -> str:
+    pandoc = check_output(['pandoc', '--version']).decode('utf-8')
+    return f'{CONVERTER_VERSION}/{pandoc.splitlines()[0]}'
+
+
+def run_pandoc(content: str) -> Tuple[int, bytes, bytes]:
+    data = content.encode('utf-8')
+    with metrics.timed('pandoc'):
+        p = Popen(args=PANDOC_ARGS, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        stdout, stderr = p.communicate(input=data)
+
+        exitcode = p.wait()
+    metrics.count('pandoc_runs')
+    metrics.count('pandoc_bytes_in', len(data))
+    metrics.count('pandoc_bytes_out', len(stdout))
+    if exitcode != 0:
+        logger.warning(f"Pandoc exited with an exitcode of {exitcode}")
+        logger.debug(f"Pandoc output: stdout:{stdout.decode('utf-8')}\n")
+        logger.debug(f"Pandoc output: stderr:{stderr.decode('utf-8')}\n")
+    return (exitcode, stdout, stderr)
+
+
+def patch_broken_content(content: str, stderr: bytes):
+    stderr_str: str = stderr.decode("utf-8")
+
+    content = re.sub("{{prettytable}} width=.+%", "{{prettytable}}",
+                     content)
+
+    split_content = content.splitlines()
+    replace = False
+    for i in range(len(split_content)):
+        if split_content[i].find("{|") != -1:
+            replace = True
+        elif split_content[i].find("|}") != -1:
+            replace = False
+
+        if replace:
+            if split_content[i].find("|}") == -1 and split_content[i].find(
+                    "{|") == -1 and split_content[i].find("!") == -1:
+                split_content[i] = split_content[i].replace("|", "!", 1)
+
+    if 'unexpected end of input' in stderr_str:
+        regex = re.search("(?s)<pre>(?!.+</pre>)", content)
+        if regex != None:
+            split_content.append("\n</pre>")
+        else:
+            regex = re.search(r"(?s)\{\|(?!.+\|\})", content)
+            if regex != None:
+                split_content.append("\n|}")
+
+    if 'unexpected "="' in stderr_str:
+        regex = re.search("line (.+),", stderr_str)
+        if regex != None:
+            num = int(regex.group(1)) - 1
+            del split_content[num]
+
+    if 'unexpected "}"' in stderr_str:
+        regex = re.search("line (.+),", stderr_str)
+        if regex != None:
+            num = int(regex.group(1)) - 1
+            split_content[num] = split_content[num].replace("}", "|}")
+
+    content = '\n'.join(split_content)
+
+    return content
+
+
+def convert_document(content: str) -> Optional[str]:
+    """
+    Converts a single document, patching it once if pandoc rejects it.
+    Returns None if the patched content can't be converted either.
+    """
+    exitcode, stdout, stderr = run_pandoc(content)
+
+    if exitcode != 0:
+        exitcode, stdout, stderr = run_pandoc(
+            patch_broken_content(content, stderr))
+
+    if exitcode != 0:
+        return None
+    return stdout.decode('utf-8')
+
+
+def can_batch(content: str) -> bool:
+    # Footnotes are collected at the end of the whole pandoc document,
+    # so documents with references have to be converted on their own.
+    return '<ref' not in content.lower()
+
+
+def join_batch(contents: List[str], marker: str) -> str:
+    return ''.join(f'{content}\n\n== {marker} ==\n\n' for content in contents)
+
+
+def split_batch_output(output: str, marker: str,
+                       count: int) -> Optional[List[str]]:
+    """
+    Splits the output of a batched conversion back into the single
+    documents. The separators are headings, so a separator swallowed by
+    an unclosed table or <pre> block won't show up as one and the batch
+    gets rejected.
+    """
+    parts = re.split(rf'^## {marker}\n', output, flags=re.MULTILINE)
+    if len(parts) != count + 1 or parts[-1].strip():
+        return None
+    return [part.strip('\n') + '\n' for part in parts[:-1]]
+
+
+class ContentConverter:
+    """
+    Converts wikitext to markdown on a pool of pandoc workers.
+
+    Documents are grouped into batches which are converted by a single
+    pandoc invocation. If a batch can't be converted as a whole, it is
+    split in halves until the broken documents are converted on their own.
+    With a cache, only documents that weren't converted before are passed
+    to pandoc.
+    """
+
+    def __init__(self,
+                 workers: int = None,
+                 batch_size: int = 50,
+                 batch_chars: int = 1000000,
+                 postprocess: Callable[[str], str] = None,
+                 cache: ConversionCache = None) -> None:
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.batch_chars = batch_chars
+        self.postprocess = postprocess
+        self.cache = cache
+
+    def _convert_joined(self, contents: List[str]) -> List[Optional[str]]:
+        if len(contents) == 1:
+            return [convert_document(contents[0])]
+
+        marker = f'MW2WJS{uuid4().hex}'
+        exitcode, stdout, _ = run_pandoc(join_batch(contents, marker))
+        if exitcode == 0:
+            parts = split_batch_output(stdout.decode('utf-8'), marker,
+                                       len(contents))
+            if parts is not None:
+                return parts
+
+        # Split the batch to narrow down the broken documents
+        half = len(contents) // 2
+        return (self._convert_joined(contents[:half]) +
+                self._convert_joined(contents[half:]))
+
+    def convert_batch(self, contents: List[str]) -> List[Optional[str]]:
+        with metrics.timed('convert_content'):
+            return self._convert_batch(contents)
+
+    def _convert_batch(self, contents: List[str]) -> List[Optional[str]]:
+        results: List[Optional[str]] = [None] * len(contents)
+
+        missing = list(range(len(contents)))
+        if self.cache is not None:
+            for i, content in enumerate(contents):
+                results[i] = self.cache.get(content)
+            missing = [i for i in missing if results[i] is None]
+        metrics.count('documents_converted', len(contents))
+        metrics.count('conversion_cache_hits', len(contents) - len(missing))
+
+        batched = [i for i in missing if can_batch(contents[i])]
+        if batched:
+            for i, result in zip(
+                    batched,
+                    self._convert_joined([contents[i] for i in batched])):
+                results[i] = result
+
+        for i in missing:
+            if not can_batch(contents[i]):
+                results[i] = convert_document(contents[i])
+
+        for i in missing:
+            if results[i] is None:
+                continue
+            if self.postprocess is not None:
+                results[i] = self.postprocess(results[i])
+            if self.cache is not None:
+                self.cache.put(contents[i], results[i])
+        return results
+
+    def _batches(self, items: Iterable,
+                 key: Callable[[Any], str]) -> Iterator[List[Any]]:
+        batch = []
+        chars = 0
+        for item in items:
+            batch.append(item)
+            chars += len(key(item))
+            if len(batch) >= self.batch_size or chars >= self.batch_chars:
+                yield batch
+                batch = []
+                chars = 0
+        if batch:
+            yield batch
+
+    def imap(self,
+             items: Iterable,
+             key: Callable[[Any], str] = lambda item: item
+             ) -> Iterator[Tuple[Any, Optional[str]]]:
+        """
+        Yields (item, markdown) pairs in the order of items. The markdown is
+        None if the item couldn't be converted. At most two batches per
+        worker are converted ahead of the consumer.
+        """
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for batch in self._batches(items, key):
+                pending.append((batch,
+                                executor.submit(self.convert_batch,
+                                                [key(item) for item in batch])))
+                while len(pending) > self.workers * 2:
+                    batch, future = pending.popleft()
+                    yield from zip(batch, future.result())
+            while pending:
+                batch, future = pending.popleft()
+                yield from zip(batch, future.result())
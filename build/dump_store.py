@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+import os
+import sqlite3
+import zlib
+from dataclasses import astuple, dataclass
+from typing import Iterable, Iterator, List, Set, Tuple
+
+
+@dataclass
+class PageMetaData:
+    content: str
+    contributor: str
+    timestamp: str
+    md_content: str = None
+
+    def __iter__(self) -> tuple:
+        return iter(astuple(self))
+
+
+class PageCollection:
+
+    def __init__(self, title: str, creation_date: str) -> None:
+        self.title: str = title
+        self.creation_date: str = creation_date
+        self.last_updated: str = ""
+        self.metadata_list: List[PageMetaData] = []
+
+    def add_entry(self, content: str, contributor: str, timestamp: str):
+        self.metadata_list.append(PageMetaData(content, contributor,
+                                               timestamp))
+        if self.last_updated < timestamp:
+            self.last_updated = timestamp
+
+    def add_markdown_to_index(self, md_content: str, index: int):
+        self[index].md_content = md_content
+
+    def __iter__(self):
+        self.i = 0
+        self.max = len(self.metadata_list) - 1
+        return self
+
+    def __next__(self):
+        if self.i <= self.max:
+            result = self.i
+            self.i += 1
+            return self.metadata_list[result]
+        else:
+            raise StopIteration
+
+    def __getitem__(self, item: int):
+        return self.metadata_list[item]
+
+    def __setitem__(self, index: int, value):
+        self.metadata_list[index] = value
+
+    def __bool__(self):
+        return bool(self.metadata_list)
+
+
+def title_to_path(title: str) -> str:
+    return title\
+        .replace(':', '/')\
+        .replace(' ', '_')\
+        .replace('.', '_')
+
+
+class DumpStore:
+    """
+    On-disk index of a MediaWiki dump.
+
+    Revision bodies are zlib compressed and appended to a sidecar file,
+    the metadata (page path, contributor, timestamp and the body offset)
+    lives in a sqlite database. Pages are handed out one at a time, so
+    only the history of a single page is held in memory.
+    """
+
+    def __init__(self, index_file: str, revisions_file: str) -> None:
+        self.index_file = index_file
+        self.revisions_file = revisions_file
+        self._db = sqlite3.connect(index_file)
+        self._db.execute('CREATE TABLE IF NOT EXISTS meta '
+                         '(key TEXT PRIMARY KEY, value TEXT)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS revisions '
+                         '(id INTEGER PRIMARY KEY, path TEXT, title TEXT, '
+                         'contributor TEXT, timestamp TEXT, '
+                         'offset INTEGER, length INTEGER)')
+        self._db.commit()
+
+    @staticmethod
+    def _source_signature(source: str) -> str:
+        stat = os.stat(source)
+        return f'{stat.st_size}:{stat.st_mtime_ns}'
+
+    def is_built_from(self, source: str) -> bool:
+        if not os.path.exists(source) or not os.path.exists(
+                self.revisions_file):
+            return False
+        row = self._db.execute(
+            "SELECT value FROM meta WHERE key = 'source'").fetchone()
+        return row is not None and row[0] == self._source_signature(source)
+
+    def build(self, entries: Iterable, source: str, batch_size: int = 1000):
+        self._db.execute('DELETE FROM revisions')
+        self._db.execute("DELETE FROM meta WHERE key = 'source'")
+        self._db.execute('DROP INDEX IF EXISTS revisions_path')
+        self._db.commit()
+
+        rows = []
+        offset = 0
+        with open(self.revisions_file, 'wb') as f:
+            for entry in entries:
+                body = zlib.compress(entry.content.encode('utf-8'))
+                f.write(body)
+                rows.append((title_to_path(entry.title), entry.title,
+                             entry.contributor, str(entry.timestamp), offset,
+                             len(body)))
+                offset += len(body)
+                if len(rows) >= batch_size:
+                    self._insert(rows)
+                    rows = []
+        self._insert(rows)
+
+        self._db.execute('CREATE INDEX revisions_path '
+                         'ON revisions (path, timestamp, id)')
+        self._db.execute("INSERT INTO meta (key, value) VALUES ('source', ?)",
+                         (self._source_signature(source), ))
+        self._db.commit()
+
+    def _insert(self, rows):
+        self._db.executemany(
+            'INSERT INTO revisions (path, title, contributor, timestamp, '
+            'offset, length) VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+    def paths(self, sort_pages: bool = True) -> Iterator[str]:
+        if sort_pages:
+            query = ('SELECT path, MIN(timestamp) AS created, MIN(id) AS first_id '
+                     'FROM revisions GROUP BY path ORDER BY created, first_id')
+        else:
+            query = ('SELECT path, MIN(id) AS first_id '
+                     'FROM revisions GROUP BY path ORDER BY first_id')
+        for row in self._db.execute(query):
+            yield row[0]
+
+    def page(self, path: str) -> PageCollection:
+        rows = self._db.execute(
+            'SELECT title, contributor, timestamp, offset, length '
+            'FROM revisions WHERE path = ? ORDER BY timestamp, id',
+            (path, )).fetchall()
+        if not rows:
+            raise KeyError(path)
+
+        collection = PageCollection(rows[0][0].split(':')[-1], rows[0][2])
+        with open(self.revisions_file, 'rb') as f:
+            for _, contributor, timestamp, offset, length in rows:
+                f.seek(offset)
+                content = zlib.decompress(f.read(length)).decode('utf-8')
+                collection.add_entry(content, contributor, timestamp)
+        return collection
+
+    def revision_count(self, path: str) -> int:
+        return self._db.execute('SELECT COUNT(*) FROM revisions WHERE path = ?',
+                                (path, )).fetchone()[0]
+
+    def pages(self,
+              sort_pages: bool = True) -> Iterator[Tuple[str, PageCollection]]:
+        for path in self.paths(sort_pages):
+            yield path, self.page(path)
+
+    def contributors(self) -> Set[str]:
+        return set(row[0] for row in self._db.execute(
+            'SELECT DISTINCT contributor FROM revisions'))
+
+    def __len__(self) -> int:
+        return self._db.execute('SELECT COUNT(*) FROM revisions').fetchone()[0]
@@ -1,47 +1,110 @@
 #!/usr/bin/env python3
 import re
+from typing import Iterable, List
 
-def fix_hyper_links(content: str):
-    split_content = content.splitlines()
+# All link forms pandoc produces, in the order they were historically
+# matched. Every part only matches up to its closing delimiter, so a
+# failed attempt never scans further than the next delimiter (or the next
+# tag for html attributes) and long lines with many links are rewritten in
+# linear time.
+# Pandoc escapes brackets in link texts, but not quotes in image titles.
+_TEXT = r'(?:[^\[\]\\\n]|\\.)'
+_TARGET = r'(?:[^\s()]|\([^\s()]*\))+'
+_TITLE = r'(?:[^"!\n]|"(?!\))|!(?!\[))+'
 
-    for index, line in enumerate(split_content):
-        split_content[index], num = re.subn(r"\[(.+?)\]\(Media:(.+?) \"wikilink\"\)",
-            lambda m: '[{}](/assets/{} "{}")'.format(
-                m.group(1),
-                m.group(2).lower(),
-                m.group(1).replace('"', '')), line)
-        if num > 0:
-            continue
+LINK_PATTERN = re.compile('|'.join([
+    rf'\[(?P<media_text>{_TEXT}+)\]\(Media:(?P<media_target>{_TARGET}) "wikilink"\)',
+    rf'\[(?P<link_text>{_TEXT}+)\]\((?P<link_target>{_TARGET}) "wikilink"\)',
+    r'<a href="(?P<a_href>[^"\n]+)"[^<>\n]*>(?P<a_text>[^<\n]+)</a>',
+    rf'!\[(?P<img_alt>{_TEXT}*)\]\((?P<img_src>{_TARGET}) "(?P<img_title>{_TITLE})"\)',
+    r'<img src="(?P<html_img_src>[^"\n]+)" title="(?P<html_img_title>[^"\n]+)"(?P<html_img_rest>[^<>\n]*?)/>',
+]))
 
-        split_content[index], num = re.subn(r"\[(.+?)\]\((.+?) \"wikilink\"\)",
-            lambda m: '[{}](/{} "{}")'.format(
-                m[1].replace(':', '/').strip(),
-                re.sub("(?<=#)(.*)", lambda m2: m2[1].lower(), m[2].replace(':', '/').replace('.', '_')),
-                m[1].replace(':', '/').replace('"', r'\"').replace('\'', r'\'')), line)
-        if num > 0:
-            continue
+PIPE_PATTERN = re.compile(r'\s*\|\s*')
 
-        split_content[index], num = re.subn("<a href=\"(.+?)\".*>(.+?)</a>",
-            lambda m: '<a href="/{0}" title="{1}">{1}</a>'.format(
-                m[1].replace(':', '/'),
-                m[2]), line)
-        if num > 0:
-            continue
 
-        split_content[index], num = re.subn(r"\!\[(.*?)\]\((.+?) \"(.+?)\"\)",
-            lambda m: '![{}](/assets/{} "{}")'.format(
-                m[1],
-                m[2].lower(),
-                m[3].replace('"', r'\"').replace('\'', r'\'')), line)
-        if num > 0:
-            continue
+def _quote(title: str) -> str:
+    return title.replace('"', r'\"').replace('\'', r'\'')
+
+
+def _lower_anchor(target: str) -> str:
+    head, sep, anchor = target.partition('#')
+    return head + sep + anchor.lower()
+
+
+def _replace_link(m: re.Match) -> str:
+    if m['media_text'] is not None:
+        return '[{}](/assets/{} "{}")'.format(
+            m['media_text'],
+            m['media_target'].lower(),
+            m['media_text'].replace('"', ''))
+
+    if m['link_text'] is not None:
+        text = m['link_text'].replace(':', '/')
+        return '[{}](/{} "{}")'.format(
+            text.strip(),
+            _lower_anchor(m['link_target'].replace(':', '/').replace('.', '_')),
+            _quote(text))
+
+    if m['a_href'] is not None:
+        return '<a href="/{0}" title="{1}">{1}</a>'.format(
+            m['a_href'].replace(':', '/'),
+            m['a_text'])
 
-        split_content[index], num = re.subn(r"<img src=\"(.+?)\" title=\"(.+?)\"(.*?)/>",
-            lambda m: '<img src="/assets/{0}" title="{1}" {2} />'.format(
-                m[1].lower(),
-                m[2],
-                m[3]), line)
+    if m['img_src'] is not None:
+        return '![{}](/assets/{} "{}")'.format(
+            m['img_alt'],
+            m['img_src'].lower(),
+            _quote(m['img_title']))
 
-    content = '\n'.join(split_content)
+    return '<img src="/assets/{0}" title="{1}" {2} />'.format(
+        m['html_img_src'].lower(),
+        m['html_img_title'],
+        m['html_img_rest'])
 
-    return content
+
+def fix_hyper_links(content: str) -> str:
+    """
+    Rewrites wiki links, media links, html links and images of a converted
+    page to wikijs paths in a single scan of the document.
+    """
+    return LINK_PATTERN.sub(_replace_link, '\n'.join(content.splitlines()))
+
+
+def fix_hyper_links_many(contents: Iterable[str]) -> List[str]:
+    """
+    Rewrites the links of a batch of converted pages.
+    """
+    return [fix_hyper_links(content) for content in contents]
+
+
+def _last_single(line: str, char: str) -> int:
+    # Position of the last bracket that isn't part of a double bracket
+    index = line.rfind(char)
+    while index != -1:
+        if (index == 0 or line[index - 1] != char) and (
+                index + 1 == len(line) or line[index + 1] != char):
+            return index
+        index = line.rfind(char, 0, index)
+    return -1
+
+
+def strip_link_pipes(content: str) -> str:
+    """
+    Replaces the pipe characters (and the whitespace around them) in
+    external links, i.e. after the last single [ and before the last
+    single ] of a line, with a space. Runs in linear time per line.
+    """
+    split_content = content.splitlines()
+    for index, line in enumerate(split_content):
+        if '|' not in line:
+            continue
+        close = _last_single(line, ']')
+        if close == -1:
+            continue
+        start = _last_single(line, '[') + 1
+        if start >= close:
+            continue
+        split_content[index] = line[:start] + PIPE_PATTERN.sub(
+            ' ', line[start:close]) + line[close:]
+    return '\n'.join(split_content)
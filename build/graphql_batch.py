@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def build_document(operation: str, fields: List[str]) -> str:
+    return '%s{%s}' % (operation, ' '.join(
+        f'op{index}: {field}' for index, field in enumerate(fields)))
+
+
+def succeeded(result: Optional[dict], field: str) -> bool:
+    """
+    Whether the mutation field of an aliased result, e.g. render in
+    {'render': {'responseResult': {'errorCode': 0}}}, succeeded. A result
+    or field that is missing or null, e.g. because of a field error, is
+    a failure.
+    """
+    response = ((result or {}).get(field) or {}).get('responseResult')
+    return response is not None and not response.get('errorCode')
+
+
+class GraphQLBatcher:
+    """
+    Sends independent GraphQL operations as aliased multi-operation
+    documents. Every document holds up to batch_size operations and up to
+    concurrency documents are in flight at the same time, all over one
+    pool of keep-alive connections. A document that fails as a whole,
+    e.g. because of a connection error or timeout, fails all of its
+    operations.
+    """
+
+    def __init__(self,
+                 url: str,
+                 token: str,
+                 batch_size: int = 50,
+                 concurrency: int = 4,
+                 timeout: float = 300) -> None:
+        self.url = url
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers['Authorization'] = f'Bearer {token}'
+        adapter = HTTPAdapter(pool_connections=concurrency,
+                              pool_maxsize=concurrency,
+                              max_retries=3)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _send(self, operation: str, fields: List[str]) -> List[Optional[dict]]:
+        metrics.count('graphql_batch_requests')
+        metrics.count('graphql_batch_operations', len(fields))
+        try:
+            with metrics.timed('graphql_batch'):
+                r = self.session.post(
+                    self.url,
+                    json={'query': build_document(operation, fields)},
+                    timeout=self.timeout)
+            metrics.count('graphql_bytes_sent', len(r.request.body or b''))
+            metrics.count('graphql_bytes_received', len(r.content))
+            r.raise_for_status()
+            body = r.json()
+        except (requests.RequestException, ValueError) as e:
+            logger.error(f'GraphQL request with {len(fields)} operations '
+                         f'failed: {e}')
+            return [None] * len(fields)
+        for error in body.get('errors') or []:
+            logger.warning(f"GraphQL error: {error.get('message')}")
+        data = body.get('data') or {}
+        return [data.get(f'op{index}') for index in range(len(fields))]
+
+    def execute_many(self, operation: str,
+                     fields: List[str]) -> List[Optional[dict]]:
+        """
+        Executes every field as its own aliased operation, e.g.
+        execute_many('mutation', ['pages{render(id: 1){responseResult{errorCode}}}']).
+        Returns the result of every field in order, None for failed ones.
+        """
+        chunks = [
+            fields[i:i + self.batch_size]
+            for i in range(0, len(fields), self.batch_size)
+        ]
+        results: List[Optional[dict]] = []
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for chunk_result in executor.map(
+                    lambda chunk: self._send(operation, chunk), chunks):
+                results += chunk_result
+        return results
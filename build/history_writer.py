@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+import logging
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional, Tuple
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryWriter:
+    """
+    Rewrites the dates and authors of the page history in wikijs' database.
+
+    Pages are queued and written in batches: the history ids of all queued
+    pages are fetched with one query, the new values are copied into
+    temporary tables and applied with one UPDATE ... FROM per table, all
+    in a single transaction per batch.
+    """
+
+    def __init__(self,
+                 connection,
+                 user_ids: Dict[str, int],
+                 batch_size: int = 200,
+                 on_flush: Callable[[List[int], List[int]], None] = None
+                 ) -> None:
+        self.connection = connection
+        self.user_ids = user_ids
+        self.batch_size = batch_size
+        self.on_flush = on_flush
+        self.pages: List[Tuple[int, List[Tuple[str, str]]]] = []
+        self.updated_dates: List[Tuple[int, str]] = []
+        self._unknown_users = set()
+
+    def add_page(self, page_id: int, versions: List[Tuple[str, str]]):
+        """
+        Queues the (timestamp, contributor) of every version of a page, in
+        the order they were pushed to wikijs.
+        """
+        if page_id == -1 or not versions:
+            return
+        self.pages.append((page_id, versions))
+        if len(self.pages) >= self.batch_size:
+            self.flush()
+
+    def add_updated_date(self, page_id: int, timestamp: str):
+        if page_id == -1:
+            return
+        self.updated_dates.append((page_id, timestamp))
+        if len(self.updated_dates) >= self.batch_size:
+            self.flush()
+
+    def _user_id(self, name: str) -> Optional[int]:
+        user_id = self.user_ids.get(name)
+        if user_id is None and name not in self._unknown_users:
+            self._unknown_users.add(name)
+            logger.warning(f"User {name} doesn't exist on wikijs, "
+                           "keeping the author of the page version.")
+        return user_id
+
+    def build_rows(self, history_ids: Dict[int, List[int]]):
+        history_rows = []
+        # Every page may only appear once in the UPDATE ... FROM
+        page_rows: Dict[int, list] = defaultdict(lambda: [None] * 4)
+        for page_id, versions in self.pages:
+            for rev_id, (timestamp, contributor) in zip(
+                    sorted(history_ids.get(page_id, [])), versions):
+                history_rows.append(
+                    (rev_id, timestamp, self._user_id(contributor)))
+            page_rows[page_id][:3] = [
+                versions[0][0],
+                self._user_id(versions[0][1]),
+                self._user_id(versions[-1][1])
+            ]
+        for page_id, timestamp in self.updated_dates:
+            page_rows[page_id][3] = timestamp
+        return history_rows, [(page_id, *row)
+                              for page_id, row in page_rows.items()]
+
+    def flush(self):
+        if not self.pages and not self.updated_dates:
+            return
+
+        with metrics.timed('sql_flush'), self.connection.transaction():
+            with self.connection.cursor() as cur:
+                history_ids: Dict[int, List[int]] = defaultdict(list)
+                if self.pages:
+                    for rev_id, page_id in cur.execute(
+                            'SELECT id, "pageId" FROM "pageHistory" '
+                            'WHERE "pageId" = ANY(%s)',
+                        ([page_id for page_id, _ in self.pages], )):
+                        history_ids[page_id].append(rev_id)
+
+                history_rows, page_rows = self.build_rows(history_ids)
+
+                cur.execute('CREATE TEMP TABLE history_update '
+                            '(id integer, "versionDate" text, '
+                            '"authorId" integer) ON COMMIT DROP')
+                with cur.copy('COPY history_update (id, "versionDate", '
+                              '"authorId") FROM STDIN') as copy:
+                    for row in history_rows:
+                        copy.write_row(row)
+                cur.execute(
+                    'UPDATE "pageHistory" AS h SET '
+                    '"versionDate" = u."versionDate", '
+                    '"authorId" = COALESCE(u."authorId", h."authorId") '
+                    'FROM history_update AS u WHERE h.id = u.id')
+
+                cur.execute('CREATE TEMP TABLE page_update '
+                            '(id integer, "createdAt" text, '
+                            '"creatorId" integer, "authorId" integer, '
+                            '"updatedAt" text) ON COMMIT DROP')
+                with cur.copy('COPY page_update (id, "createdAt", '
+                              '"creatorId", "authorId", "updatedAt") '
+                              'FROM STDIN') as copy:
+                    for row in page_rows:
+                        copy.write_row(row)
+                cur.execute(
+                    'UPDATE pages AS p SET '
+                    '"createdAt" = COALESCE(u."createdAt", p."createdAt"), '
+                    '"creatorId" = COALESCE(u."creatorId", p."creatorId"), '
+                    '"authorId" = COALESCE(u."authorId", p."authorId"), '
+                    '"updatedAt" = COALESCE(u."updatedAt", p."updatedAt") '
+                    'FROM page_update AS u WHERE p.id = u.id')
+
+        metrics.count('sql_history_rows', len(history_rows))
+        metrics.count('sql_page_rows', len(page_rows))
+        logger.info(f'Updated the history of {len(self.pages)} pages and '
+                    f'the dates of {len(self.updated_dates)} pages.')
+        if self.on_flush is not None:
+            self.on_flush([page_id for page_id, _ in self.pages],
+                          [page_id for page_id, _ in self.updated_dates])
+        self.pages = []
+        self.updated_dates = []
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+import sqlite3
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Iterable, List, Optional, Tuple
+
+PAGE_STEPS = ('history_fixed', 'rendered', 'finished')
+
+
+@dataclass
+class PageState:
+    path: str
+    page_id: Optional[int]
+    last_timestamp: Optional[str]
+    last_md_hash: Optional[str]
+    updated_at: Optional[str]
+    processed: int
+    history_fixed: bool
+    rendered: bool
+    finished: bool
+
+
+class MigrationJournal:
+    """
+    Records the progress of the migration in a sqlite database, so an
+    interrupted run can continue where it stopped and later runs only push
+    the revisions that were added to the wiki in the meantime.
+
+    For every page it keeps the wikijs page id, how many revisions of the
+    dump were pushed or skipped, the revisions that were pushed and which
+    of the steps after pushing (fixing the history dates and authors,
+    rendering, setting the last updated date) are done.
+    """
+
+    def __init__(self, journal_file: str) -> None:
+        self._db = sqlite3.connect(journal_file)
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS stages
+                (name TEXT PRIMARY KEY, finished_at TEXT);
+            CREATE TABLE IF NOT EXISTS pages
+                (path TEXT PRIMARY KEY, page_id INTEGER,
+                 last_timestamp TEXT, last_md_hash TEXT, updated_at TEXT,
+                 processed INTEGER DEFAULT 0,
+                 history_fixed INTEGER DEFAULT 0,
+                 rendered INTEGER DEFAULT 0,
+                 finished INTEGER DEFAULT 0);
+            CREATE TABLE IF NOT EXISTS revisions
+                (path TEXT, position INTEGER, timestamp TEXT,
+                 contributor TEXT, PRIMARY KEY (path, position));
+        ''')
+        self._db.commit()
+
+    def stage_done(self, name: str) -> bool:
+        return self._db.execute('SELECT 1 FROM stages WHERE name = ?',
+                                (name, )).fetchone() is not None
+
+    def finish_stage(self, name: str):
+        self._db.execute(
+            'INSERT OR REPLACE INTO stages (name, finished_at) VALUES (?, ?)',
+            (name, datetime.now(timezone.utc).isoformat()))
+        self._db.commit()
+
+    def page(self, path: str) -> Optional[PageState]:
+        row = self._db.execute(
+            'SELECT path, page_id, last_timestamp, last_md_hash, updated_at, '
+            'processed, history_fixed, rendered, finished FROM pages '
+            'WHERE path = ?', (path, )).fetchone()
+        if row is None:
+            return None
+        return PageState(*row[:6], *(bool(flag) for flag in row[6:]))
+
+    def page_ids(self) -> List[Tuple[str, int]]:
+        return self._db.execute(
+            'SELECT path, page_id FROM pages WHERE page_id IS NOT NULL'
+        ).fetchall()
+
+    def revision_pushed(self, path: str, page_id: int, position: int,
+                        timestamp: str, contributor: str, md_hash: str):
+        """
+        Records that the revision at position in the history of the page
+        in the dump was pushed.
+        """
+        self._db.execute(
+            'INSERT OR REPLACE INTO revisions '
+            '(path, position, timestamp, contributor) VALUES (?, ?, ?, ?)',
+            (path, position, timestamp, contributor))
+        self._db.execute(
+            'INSERT INTO pages (path, page_id, last_timestamp, last_md_hash, '
+            'updated_at, processed) VALUES (?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (path) DO UPDATE '
+            'SET page_id = excluded.page_id, '
+            'last_timestamp = excluded.last_timestamp, '
+            'last_md_hash = excluded.last_md_hash, '
+            'updated_at = excluded.updated_at, '
+            'processed = excluded.processed, '
+            'history_fixed = 0, rendered = 0, finished = 0',
+            (path, page_id, timestamp, md_hash, timestamp, position + 1))
+        self._db.commit()
+
+    def revision_skipped(self, path: str, position: int, timestamp: str):
+        """
+        Records that the revision at position in the history of the page
+        in the dump was skipped, so it isn't tried again.
+        """
+        self._db.execute(
+            'INSERT INTO pages (path, last_timestamp, processed) '
+            'VALUES (?, ?, ?) ON CONFLICT (path) DO UPDATE '
+            'SET last_timestamp = excluded.last_timestamp, '
+            'processed = excluded.processed', (path, timestamp, position + 1))
+        self._db.commit()
+
+    def revisions(self, path: str) -> List[Tuple[str, str]]:
+        """
+        Returns (timestamp, contributor) of every pushed revision in the
+        order they were pushed.
+        """
+        return self._db.execute(
+            'SELECT timestamp, contributor FROM revisions WHERE path = ? '
+            'ORDER BY position', (path, )).fetchall()
+
+    def forget(self, path: str):
+        self._db.execute('DELETE FROM revisions WHERE path = ?', (path, ))
+        self._db.execute('DELETE FROM pages WHERE path = ?', (path, ))
+        self._db.commit()
+
+    def pending(self, step: str) -> List[Tuple[str, int, str]]:
+        """
+        Returns (path, page_id, updated_at) of all pages for which step
+        isn't done yet.
+        """
+        assert step in PAGE_STEPS
+        return self._db.execute(
+            f'SELECT path, page_id, updated_at FROM pages '
+            f'WHERE page_id IS NOT NULL AND {step} = 0 ORDER BY path'
+        ).fetchall()
+
+    def mark(self, step: str, page_ids: Iterable[int]):
+        assert step in PAGE_STEPS
+        self._db.executemany(f'UPDATE pages SET {step} = 1 WHERE page_id = ?',
+                             [(page_id, ) for page_id in page_ids])
+        self._db.commit()
@@ -1,28 +1,36 @@
 #!/usr/bin/env python3
+import hashlib
 import json
 import sys
 import os
 import re
 from fnmatch import fnmatch
+from itertools import groupby
 import ldap
 import paramiko
 import logging
 import psycopg as psql
-from dataclasses import astuple, dataclass
-from subprocess import PIPE, Popen, call
-from typing import Generator, List
+import tarfile
+from contextlib import contextmanager
+from typing import List, Tuple
 from mediawiki_dump.dumps import LocalFileDump
 from mediawiki_dump.reader import DumpReader
-from mediawiki_dump.entry import DumpEntry
 from typing import Any, Dict
 from gql import Client, gql
 from gql.dsl import DSLQuery, DSLMutation, DSLSchema, dsl_gql
 from gql.transport.requests import RequestsHTTPTransport
-import requests
 from constants import *
 from query_defs import *
-from fix_links import fix_hyper_links
-import pickle
+from fix_links import fix_hyper_links, strip_link_pipes
+from converter import ContentConverter, converter_version
+from conversion_cache import ConversionCache
+from graphql_batch import GraphQLBatcher, succeeded
+from history_writer import HistoryWriter
+from asset_pipeline import AssetUploader, buffer_file
+from journal import MigrationJournal
+from dump_store import DumpStore, PageCollection
+import metrics
+from metrics import Progress, TimedSession
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO,
@@ -33,57 +41,6 @@ logging.basicConfig(level=logging.INFO,
 logging.getLogger("gql").setLevel(logging.WARNING)
 
 
-@dataclass
-class PageMetaData:
-    content: str
-    contributor: str
-    timestamp: str
-    md_content: str = None
-
-    def __iter__(self) -> tuple:
-        return iter(astuple(self))
-
-
-class PageCollection:
-
-    def __init__(self, title: str, creation_date: str) -> None:
-        self.title: str = title
-        self.creation_date: str = creation_date
-        self.last_updated: str = ""
-        self.metadata_list: List[PageMetaData] = []
-
-    def add_entry(self, content: str, contributor: str, timestamp: str):
-        self.metadata_list.append(PageMetaData(content, contributor,
-                                               timestamp))
-        if self.last_updated < timestamp:
-            self.last_updated = timestamp
-
-    def add_markdown_to_index(self, md_content: str, index: int):
-        self[index].md_content = md_content
-
-    def __iter__(self):
-        self.i = 0
-        self.max = len(self.metadata_list) - 1
-        return self
-
-    def __next__(self):
-        if self.i <= self.max:
-            result = self.i
-            self.i += 1
-            return self.metadata_list[result]
-        else:
-            raise StopIteration
-
-    def __getitem__(self, item: int):
-        return self.metadata_list[item]
-
-    def __setitem__(self, index: int, value):
-        self.metadata_list[index] = value
-
-    def __bool__(self):
-        return bool(self.metadata_list)
-
-
 class MediawikiMigration:
 
     def __init__(self,
@@ -105,14 +62,35 @@ class MediawikiMigration:
                 headers={'Authorization': 'Bearer ' + WIKIJS_TOKEN}),
             fetch_schema_from_transport=True,
         )
-        self._session = client.connect_sync()
+        self._session = TimedSession(client.connect_sync())
         self._dslschema = DSLSchema(client.schema)
-        self.sql_client = psql.connect(
-            conninfo=
-            f"host={WIKIJS_HOST.split('://')[-1]} port=5432 dbname=wiki user=wikijs password=1234 connect_timeout=10"
-        )
-        self.page_dump: List[DumpEntry] = None
+        self.graphql = GraphQLBatcher(WIKIJS_HOST + '/graphql',
+                                      WIKIJS_TOKEN,
+                                      batch_size=GRAPHQL_BATCH_SIZE,
+                                      concurrency=GRAPHQL_CONCURRENCY)
+        self.page_ids: Dict[str, int] = None
+        self.journal = MigrationJournal(JOURNAL)
+        self._sql_client = None
+        self.page_dump: DumpStore = None
+        self.converter = ContentConverter(workers=PANDOC_WORKERS,
+                                          batch_size=PANDOC_BATCH_SIZE,
+                                          postprocess=fix_hyper_links,
+                                          cache=ConversionCache(
+                                              CONVERSION_CACHE,
+                                              CONVERSION_CACHE_SIZE,
+                                              converter_version()))
+
+    @property
+    def sql_client(self):
+        # Only the page migration writes to the database directly
+        if self._sql_client is None:
+            self._sql_client = psql.connect(
+                conninfo=
+                f"host={WIKIJS_HOST.split('://')[-1]} port=5432 dbname=wiki user=wikijs password=1234 connect_timeout=10"
+            )
+        return self._sql_client
 
+    @metrics.timed('download_wiki_dump')
     def download_wiki_dump(self, localpath: str):
         ssh = paramiko.SSHClient()
 
@@ -130,79 +108,62 @@ class MediawikiMigration:
         stdout.channel.recv_exit_status()
 
         sftp.get("/tmp/dump.xml", localpath)
+        metrics.count('dump_bytes', os.path.getsize(localpath))
 
-    def read_dump(self,
-                  dump_file: str,
-                  sort_pages: bool = False) -> List[DumpEntry]:
+    def read_dump(self, dump_file: str) -> DumpStore:
         if not self.page_dump is None:
             return self.page_dump
-        if os.path.exists(DUMP_OBJ):
-            logger.info('Pickled object is present. loading page dump...')
-            with open(DUMP_OBJ, 'rb') as f:
-                self.page_dump = pickle.load(f)
-                return self.page_dump
-        dump = LocalFileDump(dump_file)
-        pages: Generator[DumpEntry, None, None] = DumpReader().read(dump)
-        if sort_pages:
-            self.page_dump = sorted(pages, key=lambda x: x.timestamp)
-            with open(DUMP_OBJ, 'wb') as f:
-                pickle.dump(self.page_dump, f, pickle.HIGHEST_PROTOCOL)
-            return self.page_dump
+        store = DumpStore(DUMP_INDEX, DUMP_REVISIONS)
+        if store.is_built_from(dump_file):
+            logger.info('Dump index is present. Reusing it...')
         else:
-            self.page_dump = list(pages)
-            with open(DUMP_OBJ, 'wb') as f:
-                pickle.dump(self.page_dump, f, pickle.HIGHEST_PROTOCOL)
-            return self.page_dump
-
-    def download_wiki_images(self, localpath: str):
+            logger.info('Indexing page dump...')
+            with metrics.timed('read_dump'):
+                store.build(DumpReader().read(LocalFileDump(dump_file)),
+                            dump_file)
+            logger.info(f'Indexed {len(store)} revisions.')
+        self.page_dump = store
+        return self.page_dump
+
+    @contextmanager
+    def open_asset_archive(self):
+        """
+        Streams an uncompressed tar archive of the mediawiki assets directly
+        from the ssh channel, without writing it to disk on either side.
+        Raises a RuntimeError after the archive was read if tar failed.
+        """
         ssh = paramiko.SSHClient()
 
         ssh.load_system_host_keys()
         ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
         ssh.connect(self.mediawiki_host, self.ssh_port, self.ssh_user,
                     self.ssh_passwd)
-        sftp = ssh.open_sftp()
 
-        stdin, stdout, _ = ssh.exec_command(
-            command=
-            f"cd {MEDIAWIKI_ASSETS} ; tar -czf /tmp/wiki_images.tar.gz ./*")
-        stdin.close()
+        try:
+            stdin, stdout, _ = ssh.exec_command(
+                command=f"cd {MEDIAWIKI_ASSETS} ; tar -cf - ./*")
+            stdin.close()
 
-        stdout.channel.recv_exit_status()
+            yield stdout
 
-        sftp.get("/tmp/wiki_images.tar.gz", localpath)
+            exitcode = stdout.channel.recv_exit_status()
+            if exitcode != 0:
+                raise RuntimeError(f'tar exited with an exitcode of {exitcode}')
+        finally:
+            ssh.close()
 
-    def unpack_wiki_images(self, localpath: str):
-        if not os.path.exists("/tmp/assets"):
-            os.mkdir("/tmp/assets")
-            call(args=["tar", "-xf", f"{localpath}", "-C", "/tmp/assets"])
-
-    def migrate_assets(self):
+    @metrics.timed('migrate_assets')
+    def migrate_assets(self) -> bool:
+        """
+        Uploads the files of the asset archive that are not present in wikijs
+        yet. Returns whether the whole archive was read and all of its files
+        were uploaded.
+        """
 
         url = f'{WIKIJS_HOST}/u'
 
-        headers = {'Authorization': f'Bearer {WIKIJS_TOKEN}'}
-
-        file_ext_dict = {
-            '.png': 'image/png',
-            '.jpg': 'image/jpeg',
-            '.jpeg': 'image/jpeg',
-            '.gif': 'image/gif',
-            '.pdf': 'application/pdf',
-            '.log': 'text/x-log',
-            '.bin': 'application/octet-stream',
-            '.txt': 'text/plain',
-            '.zip': 'application/zip',
-            '.diff': 'text/x-patch',
-            '.ico': 'image/x-icon'
-        }
-
         asset_folder_id = None
 
-        if not os.path.exists(WIKI_IMG_LOCATION):
-            self.download_wiki_images(WIKI_IMG_LOCATION)
-        self.unpack_wiki_images(WIKI_IMG_LOCATION)
-
         for folder in self._session.execute(
                 gql('query{assets{folders(parentFolderId:0){id,slug}}}')
         )["assets"]["folders"]:
@@ -233,112 +194,188 @@ class MediawikiMigration:
             gql("mutation{site{updateConfig(uploadMaxFileSize:104857600){responseResult{errorCode}}}}"
                 ))  # Setting the file upload size limit to 100 mb
 
-        present_files = [
+        present_files = set(
             filename['filename'] for filename in self._session.execute(
-                gql('query{assets{list(folderId: 1, kind: ALL){filename}}}'))
-            ['assets']['list']
-        ]
-
-        for base, _, files in os.walk("/tmp/assets"):
-            if files:
-                if base.find("deleted") == -1 and base.find("archive") == -1:
-                    for filename in files:
-                        if filename.lower() in present_files:
-                            logger.info(f'File {filename} already present.')
-                            continue
-                        filepath = base + "/" + filename
-                        with open(filepath, 'rb') as f:
-                            files = (('mediaUpload',
-                                      (None,
-                                       '{"folderId": %i}' % asset_folder_id)),
-                                     ('mediaUpload',
-                                      (filename, f.read(),
-                                       file_ext_dict.get(
-                                           os.path.splitext(filename)[1],
-                                           'text/plain'))))
-                            logger.info(f'Uploading file {filename}...')
-                            r = requests.post(url=url,
-                                              headers=headers,
-                                              files=files)
-                            if r.status_code != 200:
-                                logger.warning(f'Failed to upload {filepath}!')
-
-    def migrate(self,
-                page_whitelist: List[str] = [],
-                page_blacklist: List[str] = []):
-        page_dump = self.read_dump(WIKI_XML_LOCATION, sort_pages=True)
-
-        page_data: Dict[str, PageCollection] = {}
-
-        with open("./username_mapping.json", "r") as f:
-            newname_dict: Dict[str, Any] = json.load(f)
-
-        logger.info("Contructing the page_data dict")
-        for page in page_dump:
-
-            page_title = page.title.split(':')[-1]
-
-            page_path = page.title\
-                .replace(':', '/')\
-                .replace(' ', '_')\
-                .replace('.', '_')
+                gql('query{assets{list(folderId: %i, kind: ALL){filename}}}'
+                    % asset_folder_id))['assets']['list'])
+
+        uploader = AssetUploader(url,
+                                 WIKIJS_TOKEN,
+                                 asset_folder_id,
+                                 concurrency=ASSET_UPLOAD_CONCURRENCY)
+        try:
+            with self.open_asset_archive() as stream, tarfile.open(
+                    fileobj=stream, mode='r|') as archive:
+                for member in archive:
+                    if not member.isfile():
+                        continue
+                    base, filename = os.path.split(member.name)
+                    if base.find("deleted") != -1 or base.find("archive") != -1:
+                        continue
+                    if filename.lower() in present_files:
+                        logger.info(f'File {filename} already present.')
+                        continue
+                    present_files.add(filename.lower())
+                    logger.info(f'Uploading file {filename}...')
+                    metrics.count('asset_archive_bytes', member.size)
+                    uploader.submit(
+                        filename,
+                        buffer_file(archive.extractfile(member), member.size,
+                                    ASSET_MEMORY_LIMIT))
+            archive_read = True
+        except (RuntimeError, tarfile.TarError) as e:
+            logger.error(f'Failed to read the asset archive: {e}')
+            archive_read = False
+        finally:
+            uploader.close()
+        if uploader.failed:
+            logger.warning(f'Failed to upload {uploader.failed} files!')
+        return archive_read and not uploader.failed
+
+    def selected_paths(self,
+                       page_whitelist: List[str] = [],
+                       page_blacklist: List[str] = []):
+        page_dump = self.read_dump(WIKI_XML_LOCATION)
+
+        for path in page_dump.paths(sort_pages=True):
 
             if page_whitelist:
-                if not any(fnmatch(page_path, pat) for pat in page_whitelist):
+                if not any(fnmatch(path, pat) for pat in page_whitelist):
                     continue
 
             if page_blacklist:
-                if any(fnmatch(page_path, pat) for pat in page_blacklist):
+                if any(fnmatch(path, pat) for pat in page_blacklist):
                     continue
 
-            if not page_path in page_data:
-                page_data[page_path] = PageCollection(page_title,
-                                                      page.timestamp)
-            tmp = newname_dict.get(page.contributor, page.contributor)
-            if type(tmp) == str:
-                new_name = tmp
-            else:
-                new_name = tmp.get('name', page.contributor)
+            yield path
+
+    def pending_paths(self,
+                      page_whitelist: List[str] = [],
+                      page_blacklist: List[str] = [],
+                      incremental: bool = False) -> List[Tuple[str, int]]:
+        """
+        Returns the path and the number of already pushed or skipped
+        revisions of every selected page with revisions that weren't
+        processed yet.
+        """
+        page_dump = self.read_dump(WIKI_XML_LOCATION)
+
+        pending = []
+        for path in self.selected_paths(page_whitelist, page_blacklist):
+            state = self.journal.page(path)
+            processed = 0
+            if state is not None:
+                if state.finished and not incremental:
+                    continue
+                processed = state.processed
+                if page_dump.revision_count(path) <= processed:
+                    continue
+            pending.append((path, processed))
+        return pending
 
-            page_data[page_path].add_entry(page.content, new_name,
-                                           page.timestamp)
-        logger.info("Finished construction of the page_data dict")
+    def page_revisions(self, pending: List[Tuple[str, int]]):
+        page_dump = self.read_dump(WIKI_XML_LOCATION)
+
+        with open("./username_mapping.json", "r") as f:
+            newname_dict: Dict[str, Any] = json.load(f)
+
+        for path, processed in pending:
+            data: PageCollection = page_dump.page(path)
+            for entry in data:
+                tmp = newname_dict.get(entry.contributor, entry.contributor)
+                if type(tmp) == str:
+                    entry.contributor = tmp
+                else:
+                    entry.contributor = tmp.get('name', entry.contributor)
 
-        for path, data in page_data.items():
-            page_id = self.page_exists(path)
-            if page_id != -1:
-                logger.warning(
-                    f"Page {path} already existed and will be overwritten!")
-                self._session.execute(delete_page, {'id': page_id})
-                page_id = -1
             for index, entry in enumerate(data):
+                # Already pushed in an earlier run
+                if index < processed:
+                    continue
 
                 # Remove all pipe characters from external links
-                split_content = entry.content.splitlines()
-                for idx, line in enumerate(split_content):
-                    split_content[idx] = re.sub(r'(?!.*(?<!\[)\[(?!\[).*)\s*\|\s*(?=.*(?<!\])\](?!\]))', ' ', line)
-                entry.content = '\n'.join(split_content)
-
-                exitcode, stdout, stderr = self.convert_content(entry.content)
-
-                if exitcode != 0:
-                    patched_content = self.patch_broken_content(
-                        entry.content, stderr)
-                    exitcode, stdout, stderr = self.convert_content(
-                        patched_content)
-                    if exitcode != 0:
-                        for _ in range(5):
-                            exitcode, stdout, stderr = self.convert_content(
-                                patched_content)
-                            if exitcode == 0:
-                                break
-
-                if exitcode != 0:
+                entry.content = strip_link_pipes(entry.content)
+
+                yield path, data, index
+
+    @metrics.timed('migrate')
+    def migrate(self,
+                page_whitelist: List[str] = [],
+                page_blacklist: List[str] = [],
+                skip_unchanged: bool = False,
+                incremental: bool = False):
+        history = HistoryWriter(self.sql_client,
+                                self.user_ids(),
+                                SQL_BATCH_SIZE,
+                                on_flush=self.history_flushed)
+
+        self.load_page_index()
+
+        # Pages of earlier runs are continued, unless they were removed
+        # from wikijs in the meantime
+        known_ids = set(self.page_ids.values())
+        for path, page_id in self.journal.page_ids():
+            if page_id not in known_ids:
+                logger.warning(f"Page {path} was removed from wikijs "
+                               "and will be migrated again.")
+                self.journal.forget(path)
+        journal_paths = set(path for path, _ in self.journal.page_ids())
+
+        existing_pages = [
+            path for path in self.selected_paths(page_whitelist, page_blacklist)
+            if path in self.page_ids and path not in journal_paths
+        ]
+        for path in existing_pages:
+            logger.warning(
+                f"Page {path} already existed and will be overwritten!")
+        # Pages that are still there can't be created again, they are left
+        # out until a later run manages to delete them
+        undeleted = set(self.delete_pages(existing_pages))
+        for path in undeleted:
+            logger.error(f"Page {path} is skipped, because it couldn't be "
+                         "deleted.")
+
+        pending = [
+            page for page in self.pending_paths(page_whitelist, page_blacklist,
+                                                incremental)
+            if page[0] not in undeleted
+        ]
+        progress = Progress(len(pending))
+        logger.info(f'Migrating {len(pending)} pages...')
+
+        converted = self.converter.imap(
+            self.page_revisions(pending),
+            key=lambda revision: revision[1][revision[2]].content)
+
+        for path, revisions in groupby(converted,
+                                       key=lambda result: result[0][0]):
+            state = self.journal.page(path)
+            page_id = -1
+            previous_md_hash = None
+            if state is not None:
+                if state.page_id is not None:
+                    page_id = state.page_id
+                    logger.info(f"Continuing page {path}.")
+                previous_md_hash = state.last_md_hash
+
+            for (_, data, index), md_content in revisions:
+                entry = data[index]
+
+                if md_content is None:
                     logger.error(f"Failed to convert {path} version {index}")
-                    data[index] = None
+                    metrics.count('conversion_failures')
+                    self.journal.revision_skipped(path, index, entry.timestamp)
+                    continue
+
+                md_hash = hashlib.sha256(md_content.encode('utf-8')).hexdigest()
+                if skip_unchanged and page_id != -1 and md_hash == previous_md_hash:
+                    logger.info(f"Skipped unchanged version {index} of {path}.")
+                    metrics.count('revisions_unchanged')
+                    self.journal.revision_skipped(path, index, entry.timestamp)
                     continue
+                previous_md_hash = md_hash
 
-                entry.md_content = fix_hyper_links(stdout.decode('utf-8'))
+                entry.md_content = md_content
 
                 script = ''
                 if entry.content.startswith('#REDIRECT') or entry.content.startswith('#WEITERLEITUNG'):
@@ -363,29 +400,46 @@ class MediawikiMigration:
                         })
                     try:
                         page_id = result["pages"]["create"]["page"]["id"]
+                        self.page_ids[path] = page_id
                     except:
                         logger.error(result['pages']['create']
                                      ['responseResult']['slug'])
+                        self.journal.revision_skipped(path, index, entry.timestamp)
+                        continue
                     logger.info(f"Created {path}.")
 
-            data = list(filter(None, data))
-            page_data[path] = data
-
-            if page_whitelist:
-                logger.info(f"Rendering page {path}...")
-                self._session.execute(
-                    gql('mutation{pages{render(id: %i){responseResult{errorCode}}}}'
-                        % page_id))
-            logger.info(f"Changing dates of page {path}...")
-            self.change_page_dates(page_id, data)
-            logger.info(f"Finished changing dates of page {path}.")
-            logger.info(f"Changing authors of page {path}...")
-            self.change_page_authors(page_id, data)
-            logger.info(f"Finished changing authors of page {path}.")
-
-        page_data = {k: v for k, v in page_data.items() if v}
-
-        path_id_dict = {}
+                self.journal.revision_pushed(path, page_id, index,
+                                             entry.timestamp, entry.contributor,
+                                             md_hash)
+                metrics.count('revisions_pushed')
+                progress.advance(revisions=1)
+
+            history.add_page(page_id, self.journal.revisions(path))
+            metrics.count('pages_migrated')
+            progress.advance(pages=1)
+        history.flush()
+
+        # Pages pushed by an earlier run that didn't get that far
+        for path, page_id, _ in self.journal.pending('history_fixed'):
+            history.add_page(page_id, self.journal.revisions(path))
+        history.flush()
+
+        pending = self.journal.pending('rendered')
+        logger.info(f'Rendering {len(pending)} pages...')
+        rendered = self.render_pages([page_id for _, page_id, _ in pending])
+        self.journal.mark('rendered', rendered)
+
+        logger.info('Updating the last updated timestamps...')
+        for _, page_id, updated_at in self.journal.pending('finished'):
+            history.add_updated_date(page_id, updated_at)
+        history.flush()
+
+    def history_flushed(self, fixed_ids: List[int], dated_ids: List[int]):
+        self.journal.mark('history_fixed', fixed_ids)
+        self.journal.mark('finished', dated_ids)
+
+    def load_page_index(self):
+        self.page_ids = {}
         for item in self._session.execute(
                 dsl_gql(
                     DSLQuery(
@@ -394,158 +448,51 @@ class MediawikiMigration:
                                 self._dslschema.PageListItem.id,
                                 self._dslschema.PageListItem.path))))
         )['pages']['list']:
-            path_id_dict[item["path"]] = item["id"]
-
-        for path, data in page_data.items():
-            if not page_whitelist:
-                logger.info(f'Rerendering page {path}...')
-                self._session.execute(
-                    gql('mutation{pages{render(id: %i){responseResult{errorCode}}}}'
-                        % path_id_dict[path]))
-            logger.info(f"Updating last updated timestamp for page {path}...")
-            self.change_latest_page_dates(path_id_dict[path], data)
-
-    def convert_content(self, content: str):
-        p = Popen(args=[
-            'pandoc', '-f', 'mediawiki', '-t', 'gfm', '-o', '/dev/stdout',
-            '--wrap=none'
-        ],
-                  stdin=PIPE,
-                  stdout=PIPE,
-                  stderr=PIPE)
-        stdout, stderr = p.communicate(input=content.encode('utf-8'))
-
-        exitcode = p.wait()
-        if exitcode != 0:
-            logger.warning(f"Pandoc exited with an exitcode of {exitcode}")
-            logger.debug(f"Pandoc output: stdout:{stdout.decode('utf-8')}\n")
-            logger.debug(f"Pandoc output: stderr:{stderr.decode('utf-8')}\n")
-        return (exitcode, stdout, stderr)
-
-
-    def patch_broken_content(self, content: str, stderr: bytes):
-        stderr_str: str = stderr.decode("utf-8")
-
-        content = re.sub("{{prettytable}} width=.+%", "{{prettytable}}",
-                         content)
-
-        split_content = content.splitlines()
-        replace = False
-        for i in range(len(split_content)):
-            if split_content[i].find("{|") != -1:
-                replace = True
-            elif split_content[i].find("|}") != -1:
-                replace = False
-
-            if replace:
-                if split_content[i].find("|}") == -1 and split_content[i].find(
-                        "{|") == -1 and split_content[i].find("!") == -1:
-                    split_content[i] = split_content[i].replace("|", "!", 1)
-
-        if 'unexpected end of input' in stderr_str:
-            regex = re.search("(?s)<pre>(?!.+</pre>)", content)
-            if regex != None:
-                split_content.append("\n</pre>")
+            self.page_ids[item["path"]] = item["id"]
+
+    def delete_pages(self, paths: List[str]) -> List[str]:
+        """
+        Deletes the pages from wikijs and returns the paths of the pages
+        that couldn't be deleted. These stay in the page index.
+        """
+        results = self.graphql.execute_many('mutation', [
+            'pages{delete(id: %i){responseResult{errorCode}}}' %
+            self.page_ids[path] for path in paths
+        ])
+        failed = []
+        for path, result in zip(paths, results):
+            if succeeded(result, 'delete'):
+                del self.page_ids[path]
             else:
-                regex = re.search(r"(?s)\{\|(?!.+\|\})", content)
-                if regex != None:
-                    split_content.append("\n|}")
-
-        if 'unexpected "="' in stderr_str:
-            regex = re.search("line (.+),", stderr_str)
-            if regex != None:
-                num = int(regex.group(1)) - 1
-                del split_content[num]
-
-        if 'unexpected "}"' in stderr_str:
-            regex = re.search("line (.+),", stderr_str)
-            if regex != None:
-                num = int(regex.group(1)) - 1
-                split_content[num] = split_content[num].replace("}", "|}")
-
-        content = '\n'.join(split_content)
-
-        return content
-
-    def page_exists(self, path: str) -> int:
-        page_result = self._session.execute(
-            search_page, {'path': path})['pages']['search']['results']
-
-        for obj in page_result:
-            id, l_path = obj.values()
-            if l_path == path:
-                return int(id)
-        return -1
-
-    def change_page_dates(self, page_id: int, collection: List[PageMetaData]):
-        if page_id == -1:
-            return
-        with self.sql_client.cursor() as cur:
-            rev_id_list: List[int] = [
-                item[0] for item in sorted(cur.execute(
-                    f"SELECT id FROM \"pageHistory\" WHERE \"pageId\"={page_id}"
-                    .encode()).fetchall(),
-                                           key=lambda x: x[0])
-            ]
-
-            for rev_id, entry in zip(rev_id_list, collection):
-                cur.execute(
-                    f'UPDATE "pageHistory" SET "versionDate" = \'{entry.timestamp}\' WHERE id={rev_id}'
-                    .encode())
-
-            cur.execute(
-                f'UPDATE pages SET "createdAt" = \'{collection[0].timestamp}\' WHERE id={page_id}'
-                .encode())
-        self.sql_client.commit()
-
-    def change_latest_page_dates(self, page_id: int,
-                                 collection: PageCollection):
-        if page_id == -1:
-            return
-        with self.sql_client.cursor() as cur:
-            cur.execute(
-                f'UPDATE pages SET "updatedAt" = \'{collection[-1].timestamp}\' WHERE id={page_id}'
-                .encode())
-
-        self.sql_client.commit()
-
-    def change_page_authors(self, page_id: int,
-                            collection: List[PageMetaData]):
-        if page_id == -1:
-            return
-        global user_id_dict
-
-        if 'user_id_dict' not in globals():
-            query = dsl_gql(
-                DSLQuery(
-                    self._dslschema.Query.users.select(
-                        self._dslschema.UserQuery.list.select(
-                            self._dslschema.UserMinimal.name,
-                            self._dslschema.UserMinimal.id))))
-            user_id_list = [
-                user.values()
-                for user in self._session.execute(query)["users"]["list"]
-            ]
-
-            user_id_dict = dict(user_id_list)
-
-        with self.sql_client.cursor() as cur:
-            rev_id_list: List[int] = [
-                item[0] for item in sorted(cur.execute(
-                    f"SELECT id FROM \"pageHistory\" WHERE \"pageId\"={page_id}"
-                    .encode()).fetchall(),
-                                           key=lambda x: x[0])
-            ]
-
-            for rev_id, entry in zip(rev_id_list, collection):
-                cur.execute(
-                    f'UPDATE "pageHistory" SET "authorId" = \'{user_id_dict[entry.contributor]}\' WHERE id={rev_id}'
-                    .encode())
-
-            cur.execute(
-                f'UPDATE pages SET "creatorId" = \'{user_id_dict[collection[0].contributor]}\', "authorId" = \'{user_id_dict[collection[-1].contributor]}\' WHERE id={page_id}'
-                .encode())
-        self.sql_client.commit()
+                logger.error(f"Failed to delete page {path}!")
+                failed.append(path)
+        return failed
+
+    @metrics.timed('render_pages')
+    def render_pages(self, page_ids: List[int]) -> List[int]:
+        results = self.graphql.execute_many('mutation', [
+            'pages{render(id: %i){responseResult{errorCode}}}' % page_id
+            for page_id in page_ids
+        ])
+        rendered = []
+        for page_id, result in zip(page_ids, results):
+            if succeeded(result, 'render'):
+                rendered.append(page_id)
+            else:
+                logger.warning(f"Failed to render page with id {page_id}!")
+        return rendered
+
+    def user_ids(self) -> Dict[str, int]:
+        query = dsl_gql(
+            DSLQuery(
+                self._dslschema.Query.users.select(
+                    self._dslschema.UserQuery.list.select(
+                        self._dslschema.UserMinimal.name,
+                        self._dslschema.UserMinimal.id))))
+        return {
+            user['name']: user['id']
+            for user in self._session.execute(query)["users"]["list"]
+        }
 
     def update_timezone_of_all_users(self, timezone: str = "America/New_York"):
         user_id_list = [
@@ -558,24 +505,19 @@ class MediawikiMigration:
             ['list']
         ]
 
-        for id in user_id_list:
-            query = dsl_gql(
-                DSLMutation(
-                    self._dslschema.Mutation.users.select(
-                        self._dslschema.UserMutation.update(
-                            id=id, timezone=timezone).select(
-                                self._dslschema.DefaultResponse.responseResult.
-                                select(self._dslschema.ResponseStatus.errorCode
-                                       )))))
-            self._session.execute(query)
+        self.graphql.execute_many('mutation', [
+            'users{update(id: %i, timezone: %s){responseResult{errorCode}}}' %
+            (id, json.dumps(timezone)) for id in user_id_list
+        ])
 
+    @metrics.timed('import_users_from_wiki')
     def import_users_from_wiki(self):
-        page_dump = self.read_dump(WIKI_XML_LOCATION, sort_pages=True)
+        page_dump = self.read_dump(WIKI_XML_LOCATION)
 
         with open("./username_mapping.json", "r") as f:
             newname_dict: Dict[str, Any] = json.load(f)
 
-        wiki_users = set([page.contributor for page in page_dump])
+        wiki_users = page_dump.contributors()
 
         wikijs_users = [
             user["name"] for user in self._session.execute(
@@ -880,25 +822,44 @@ class MediawikiMigration:
 
 
 def main():
+    metrics.REGISTRY.configure(PROFILE_STAGE)
     migration = MediawikiMigration(MEDIAWIKI_HOST, MEDIAWIKI_SSH_USER,
                                    MEDIAWIKI_SSH_PASSWD, WIKIJS_HOST,
                                    WIKIJS_TOKEN, MEDIAWIKI_SSH_PORT)
-    migration.set_defaults()
-    if not os.path.exists(WIKI_XML_LOCATION):
+    journal = migration.journal
+    incremental = INCREMENTAL.lower() == 'true'
+    try:
+        run_stages(migration, journal, incremental)
+    finally:
+        metrics.REGISTRY.write(METRICS_JSON, METRICS_PROM, PROFILE_FILE)
+
+
+def run_stages(migration: MediawikiMigration, journal: MigrationJournal,
+               incremental: bool):
+    if not journal.stage_done('defaults'):
+        migration.set_defaults()
+        journal.finish_stage('defaults')
+    if incremental or not os.path.exists(WIKI_XML_LOCATION):
         migration.download_wiki_dump(WIKI_XML_LOCATION)
-    if IMPORT_LDAP.lower() == 'true':
+    if IMPORT_LDAP.lower() == 'true' and not journal.stage_done('ldap_users'):
         migration.import_ldap_users()
-    migration.import_users_from_wiki()
-    migration.update_timezone_of_all_users(USER_TIMEZONE)
-    if MEDIAWIKI_ASSETS:
-        migration.migrate_assets()
+        journal.finish_stage('ldap_users')
+    if incremental or not journal.stage_done('wiki_users'):
+        migration.import_users_from_wiki()
+        migration.update_timezone_of_all_users(USER_TIMEZONE)
+        journal.finish_stage('wiki_users')
+    if MEDIAWIKI_ASSETS and (incremental or not journal.stage_done('assets')):
+        if migration.migrate_assets():
+            journal.finish_stage('assets')
     page_blacklist = []
     try:
         with open('/page_blacklist.txt', 'r') as f:
             page_blacklist=f.read().splitlines()
     except FileNotFoundError:
         logger.info('No page blacklist provided.')
-    migration.migrate(page_blacklist=page_blacklist)
+    migration.migrate(page_blacklist=page_blacklist,
+                      skip_unchanged=SKIP_UNCHANGED_REVISIONS.lower() == 'true',
+                      incremental=incremental)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+import bisect
+import cProfile
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+PREFIX = 'mw2wjs'
+
+# Upper bounds in seconds, from single GraphQL requests to whole stages
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60, 300, 1800)
+
+
+class Histogram:
+
+    def __init__(self, buckets=BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def cumulative(self) -> List[int]:
+        result = []
+        total = 0
+        for count in self.counts:
+            total += count
+            result.append(total)
+        return result
+
+    def to_dict(self) -> dict:
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'min': self.min,
+            'max': self.max,
+            'mean': self.sum / self.count if self.count else None,
+            'buckets': dict(
+                zip([str(bound) for bound in self.buckets] + ['+Inf'],
+                    self.cumulative())),
+        }
+
+
+class Metrics:
+    """
+    Collects counters (requests, bytes, rows, ...) and latency histograms
+    per stage of the migration. It is shared by all threads, so the
+    components record into the module level REGISTRY like they log into
+    their logger.
+
+    If a profile stage is set, every run of that stage is profiled with
+    cProfile. Only one thread is profiled at a time, runs of the stage on
+    other threads in the meantime are only timed.
+    """
+
+    def __init__(self) -> None:
+        self.started = time.time()
+        self.counters: Dict[str, float] = {}
+        self.histograms: Dict[str, Histogram] = {}
+        self.profile_stage: Optional[str] = None
+        self.profiler: Optional[cProfile.Profile] = None
+        self._profiling = threading.Lock()
+        self._lock = threading.Lock()
+
+    def configure(self, profile_stage: Optional[str] = None):
+        self.profile_stage = profile_stage or None
+        self.profiler = cProfile.Profile() if self.profile_stage else None
+
+    def count(self, name: str, value: float = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, stage: str, seconds: float):
+        with self._lock:
+            if stage not in self.histograms:
+                self.histograms[stage] = Histogram()
+            self.histograms[stage].observe(seconds)
+
+    @contextmanager
+    def timed(self, stage: str):
+        profile = (stage == self.profile_stage and
+                   self._profiling.acquire(blocking=False))
+        if profile:
+            self.profiler.enable()
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.count(f'{stage}_errors')
+            raise
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+            if profile:
+                self.profiler.disable()
+                self._profiling.release()
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                'started': self.started,
+                'duration': time.time() - self.started,
+                'counters': dict(self.counters),
+                'stages': {
+                    stage: histogram.to_dict()
+                    for stage, histogram in self.histograms.items()
+                },
+            }
+
+    def prometheus(self) -> str:
+        lines = [
+            f'# TYPE {PREFIX}_duration_seconds gauge',
+            f'{PREFIX}_duration_seconds {time.time() - self.started}',
+        ]
+        with self._lock:
+            for name, value in sorted(self.counters.items()):
+                lines.append(f'# TYPE {PREFIX}_{name}_total counter')
+                lines.append(f'{PREFIX}_{name}_total {value}')
+            lines.append(f'# TYPE {PREFIX}_stage_seconds histogram')
+            for stage, histogram in sorted(self.histograms.items()):
+                for bound, count in zip(
+                        [str(bound) for bound in histogram.buckets] + ['+Inf'],
+                        histogram.cumulative()):
+                    lines.append(f'{PREFIX}_stage_seconds_bucket'
+                                 f'{{stage="{stage}",le="{bound}"}} {count}')
+                lines.append(f'{PREFIX}_stage_seconds_sum'
+                             f'{{stage="{stage}"}} {histogram.sum}')
+                lines.append(f'{PREFIX}_stage_seconds_count'
+                             f'{{stage="{stage}"}} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, json_file: str, prometheus_file: str,
+              profile_file: str = None):
+        with open(json_file, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        with open(prometheus_file, 'w') as f:
+            f.write(self.prometheus())
+        if self.profiler is not None and profile_file is not None:
+            self.profiler.dump_stats(profile_file % self.profile_stage)
+        logger.info(f'Wrote the metrics to {json_file}.')
+
+
+class Progress:
+    """
+    Logs the number of migrated pages and revisions, their rate and the
+    estimated remaining time at most every interval seconds.
+    """
+
+    def __init__(self, total_pages: int, interval: float = 30) -> None:
+        self.total_pages = total_pages
+        self.interval = interval
+        self.pages = 0
+        self.revisions = 0
+        self.started = time.monotonic()
+        self.logged = self.started
+
+    def advance(self, pages: int = 0, revisions: int = 0):
+        self.pages += pages
+        self.revisions += revisions
+        now = time.monotonic()
+        if now - self.logged >= self.interval or (
+                pages and self.pages == self.total_pages):
+            self.logged = now
+            logger.info(self.status(now))
+
+    def status(self, now: float = None) -> str:
+        elapsed = max((now or time.monotonic()) - self.started, 1e-9)
+        page_rate = self.pages / elapsed
+        eta = 'unknown'
+        if page_rate:
+            eta = str(timedelta(seconds=round(
+                (self.total_pages - self.pages) / page_rate)))
+        return (f'Migrated {self.pages}/{self.total_pages} pages and '
+                f'{self.revisions} revisions '
+                f'({page_rate:.2f} pages/s, '
+                f'{self.revisions / elapsed:.2f} revisions/s), '
+                f'ETA {eta}.')
+
+
+class TimedSession:
+    """
+    Wraps a gql session, so every execute is timed as the given stage.
+    """
+
+    def __init__(self, session, stage: str = 'graphql') -> None:
+        self._wrapped = session
+        self._stage = stage
+
+    def execute(self, *args, **kwargs):
+        REGISTRY.count(f'{self._stage}_requests')
+        with REGISTRY.timed(self._stage):
+            return self._wrapped.execute(*args, **kwargs)
+
+    def __getattr__(self, name: str):
+        return getattr(self._wrapped, name)
+
+
+REGISTRY = Metrics()
+count = REGISTRY.count
+timed = REGISTRY.timed
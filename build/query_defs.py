@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 from gql import Client
-from gql.dsl import DSLMutation, DSLSchema, DSLVariableDefinitions, DSLQuery, dsl_gql
+from gql.dsl import DSLMutation, DSLSchema, DSLVariableDefinitions, dsl_gql
 from gql.transport.requests import RequestsHTTPTransport
 from uuid import uuid4
 from constants import *
@@ -32,19 +32,6 @@ create_user = DSLMutation(
 create_user.variable_definitions = __var
 create_user = dsl_gql(create_user)
 
-__var = DSLVariableDefinitions()
-delete_page = DSLMutation(
-    schema.Mutation.pages.select(
-        schema.PageMutation.delete(id=__var.id).select(
-            schema.DefaultResponse.responseResult.select(
-                schema.ResponseStatus.errorCode
-            )
-        )
-    )
-)
-delete_page.variable_definitions = __var
-delete_page = dsl_gql(delete_page)
-
 __var = DSLVariableDefinitions()
 update_page = DSLMutation(
     schema.Mutation.pages.select(
@@ -84,17 +71,3 @@ create_page = DSLMutation(
 )
 create_page.variable_definitions = __var
 create_page = dsl_gql(create_page)
-
-__var = DSLVariableDefinitions()
-search_page = DSLQuery(
-    schema.Query.pages.select(
-        schema.PageQuery.search(query=__var.path).select(
-            schema.PageSearchResponse.results.select(
-                schema.PageSearchResult.id, schema.PageSearchResult.path
-            )
-        )
-    )
-)
-search_page.variable_definitions = __var
-search_page = dsl_gql(search_page)
-
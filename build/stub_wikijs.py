@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+import psycopg as psql
+from graphql import build_schema, graphql_sync
+
+# The part of the wikijs schema that query_defs.py and the migration use,
+# without the authentication, group and localization queries of the LDAP
+# import and the defaults.
+SDL = '''
+type Query {
+  pages: PageQuery
+  users: UserQuery
+  assets: AssetQuery
+}
+type Mutation {
+  pages: PageMutation
+  users: UserMutation
+  assets: AssetMutation
+  site: SiteMutation
+}
+
+type ResponseStatus { succeeded: Boolean! errorCode: Int! slug: String! message: String }
+type DefaultResponse { responseResult: ResponseStatus }
+
+type Page { id: Int! path: String! title: String! content: String! }
+type PageResponse { responseResult: ResponseStatus! page: Page }
+type PageSearchResult { id: String! title: String! description: String! path: String! locale: String! }
+type PageSearchResponse { results: [PageSearchResult]! suggestions: [String]! totalHits: Int! }
+type PageListItem { id: Int! path: String! locale: String! title: String }
+type PageQuery {
+  search(query: String!, path: String, locale: String): PageSearchResponse!
+  list(limit: Int, locale: String): [PageListItem!]!
+}
+type PageMutation {
+  create(content: String!, description: String!, editor: String!, isPublished: Boolean!, isPrivate: Boolean!, locale: String!, path: String!, scriptCss: String, scriptJs: String, tags: [String]!, title: String!): PageResponse
+  update(id: Int!, content: String, description: String, editor: String, isPrivate: Boolean, isPublished: Boolean, locale: String, path: String, scriptCss: String, scriptJs: String, tags: [String], title: String): PageResponse
+  delete(id: Int!): DefaultResponse
+  render(id: Int!): DefaultResponse
+}
+
+type UserMinimal { id: Int! name: String! email: String! providerKey: String! }
+type UserResponse { responseResult: ResponseStatus! }
+type UserQuery {
+  list(filter: String, orderBy: String): [UserMinimal]
+  search(query: String!): [UserMinimal]
+}
+type UserMutation {
+  create(email: String!, name: String!, passwordRaw: String, providerKey: String!, groups: [Int]!): UserResponse
+  update(id: Int!, name: String, timezone: String): DefaultResponse
+  deactivate(id: Int!): DefaultResponse
+}
+
+enum AssetKind { IMAGE BINARY ALL }
+type AssetFolder { id: Int! slug: String! name: String }
+type AssetItem { id: Int! filename: String! fileSize: Int! }
+type AssetQuery {
+  list(folderId: Int!, kind: AssetKind!): [AssetItem]
+  folders(parentFolderId: Int!): [AssetFolder]
+}
+type AssetMutation { createFolder(parentFolderId: Int!, slug: String!, name: String): DefaultResponse }
+
+type SiteMutation { updateConfig(uploadMaxFileSize: Int): DefaultResponse }
+'''
+
+# The columns of the wikijs tables the migration rewrites
+SCHEMA_SQL = '''
+CREATE TABLE IF NOT EXISTS pages (
+    id integer PRIMARY KEY, path varchar(255),
+    "createdAt" varchar(255), "updatedAt" varchar(255),
+    "creatorId" integer, "authorId" integer);
+CREATE TABLE IF NOT EXISTS "pageHistory" (
+    id integer PRIMARY KEY, "pageId" integer,
+    "versionDate" varchar(255), "authorId" integer);
+'''
+
+
+def result(error_code: int = 0, **fields) -> dict:
+    return dict(responseResult={
+        'succeeded': error_code == 0,
+        'errorCode': error_code,
+        'slug': 'ok' if error_code == 0 else 'error',
+        'message': '',
+    }, **fields)
+
+
+class StubWiki:
+    """
+    Keeps the pages, users and assets of the stub in memory. Created and
+    updated pages are also written to the pages and pageHistory tables of
+    a database, like wikijs does, so the history rewrite has rows to
+    update.
+    """
+
+    def __init__(self, conninfo: Optional[str] = None) -> None:
+        self.lock = threading.Lock()
+        self.pages = {}
+        self.users = {
+            1: {'id': 1, 'name': 'Administrator', 'email': 'admin@example.com',
+                'providerKey': 'local'}
+        }
+        self.folders = {}
+        self.assets = {}
+        self.next_history_id = 1
+        self.uploaded_bytes = 0
+        self.sql = None
+        if conninfo:
+            self.sql = psql.connect(conninfo, autocommit=True)
+            self.sql.execute(SCHEMA_SQL)
+
+    def _now(self) -> str:
+        return time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime())
+
+
+class PageQuery:
+
+    def __init__(self, wiki: StubWiki) -> None:
+        self.wiki = wiki
+
+    def search(self, info, query, **kwargs):
+        return {
+            'results': [{
+                'id': str(page['id']),
+                'title': page['title'],
+                'description': '',
+                'path': page['path'],
+                'locale': 'en',
+            } for page in list(self.wiki.pages.values())
+                        if query in page['path']],
+            'suggestions': [],
+            'totalHits': 0,
+        }
+
+    def list(self, info, **kwargs):
+        return [{
+            'id': page['id'],
+            'path': page['path'],
+            'locale': 'en',
+            'title': page['title'],
+        } for page in list(self.wiki.pages.values())]
+
+
+class PageMutation:
+
+    def __init__(self, wiki: StubWiki) -> None:
+        self.wiki = wiki
+
+    def create(self, info, path, title, content, **kwargs):
+        wiki = self.wiki
+        with wiki.lock:
+            if any(page['path'] == path for page in wiki.pages.values()):
+                return result(6002)  # PageDuplicateCreate
+            page_id = max(wiki.pages, default=0) + 1
+            page = {'id': page_id, 'path': path, 'title': title,
+                    'content': content}
+            wiki.pages[page_id] = page
+            if wiki.sql is not None:
+                now = wiki._now()
+                wiki.sql.execute(
+                    'INSERT INTO pages (id, path, "createdAt", "updatedAt", '
+                    '"creatorId", "authorId") VALUES (%s, %s, %s, %s, 1, 1)',
+                    (page_id, path, now, now))
+        return result(page=page)
+
+    def update(self, info, id, content=None, **kwargs):
+        wiki = self.wiki
+        with wiki.lock:
+            if id not in wiki.pages:
+                return result(6003)  # PageNotFound
+            # wikijs keeps the replaced version in the history
+            history_id = wiki.next_history_id
+            wiki.next_history_id += 1
+            if content is not None:
+                wiki.pages[id]['content'] = content
+            if wiki.sql is not None:
+                now = wiki._now()
+                wiki.sql.execute(
+                    'INSERT INTO "pageHistory" (id, "pageId", "versionDate", '
+                    '"authorId") VALUES (%s, %s, %s, 1)', (history_id, id, now))
+                wiki.sql.execute(
+                    'UPDATE pages SET "updatedAt" = %s WHERE id = %s',
+                    (now, id))
+        return result(page=None)
+
+    def delete(self, info, id):
+        wiki = self.wiki
+        with wiki.lock:
+            if wiki.pages.pop(id, None) is None:
+                return result(6003)
+            if wiki.sql is not None:
+                wiki.sql.execute('DELETE FROM "pageHistory" WHERE "pageId" = %s',
+                                 (id, ))
+                wiki.sql.execute('DELETE FROM pages WHERE id = %s', (id, ))
+        return result()
+
+    def render(self, info, id):
+        return result(0 if id in self.wiki.pages else 6003)
+
+
+class UserQuery:
+
+    def __init__(self, wiki: StubWiki) -> None:
+        self.wiki = wiki
+
+    def list(self, info, **kwargs):
+        return list(self.wiki.users.values())
+
+    def search(self, info, query):
+        return [user for user in list(self.wiki.users.values())
+                if query in user['name']]
+
+
+class UserMutation:
+
+    def __init__(self, wiki: StubWiki) -> None:
+        self.wiki = wiki
+
+    def create(self, info, email, name, providerKey, **kwargs):
+        wiki = self.wiki
+        with wiki.lock:
+            if any(user['email'] == email for user in wiki.users.values()):
+                return result(1004)  # AuthAccountAlreadyExists
+            user_id = max(wiki.users) + 1
+            wiki.users[user_id] = {'id': user_id, 'name': name,
+                                   'email': email, 'providerKey': providerKey}
+        return result()
+
+    def update(self, info, id, **kwargs):
+        return result()
+
+    def deactivate(self, info, id):
+        return result()
+
+
+class AssetQuery:
+
+    def __init__(self, wiki: StubWiki) -> None:
+        self.wiki = wiki
+
+    def list(self, info, folderId, kind):
+        return [asset for asset in list(self.wiki.assets.values())
+                if asset['folderId'] == folderId]
+
+    def folders(self, info, parentFolderId):
+        return list(self.wiki.folders.values())
+
+
+class AssetMutation:
+
+    def __init__(self, wiki: StubWiki) -> None:
+        self.wiki = wiki
+
+    def createFolder(self, info, parentFolderId, slug, name=None):
+        wiki = self.wiki
+        with wiki.lock:
+            folder_id = len(wiki.folders) + 1
+            wiki.folders[folder_id] = {'id': folder_id, 'slug': slug,
+                                       'name': name}
+        return result()
+
+
+class SiteMutation:
+
+    def updateConfig(self, info, **kwargs):
+        return result()
+
+
+class Root:
+    """
+    The default resolver of graphql-core calls the methods of these
+    objects with the arguments of the field.
+    """
+
+    def __init__(self, wiki: StubWiki, mutation: bool) -> None:
+        self.pages = PageMutation(wiki) if mutation else PageQuery(wiki)
+        self.users = UserMutation(wiki) if mutation else UserQuery(wiki)
+        self.assets = AssetMutation(wiki) if mutation else AssetQuery(wiki)
+        self.site = SiteMutation()
+
+
+def make_handler(wiki: StubWiki, latency: float):
+    schema = build_schema(SDL)
+    roots = {
+        'query': Root(wiki, mutation=False),
+        'mutation': Root(wiki, mutation=True),
+    }
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # Headers and body are written separately, with Nagle's algorithm
+        # every keep-alive request would wait for a delayed ACK.
+        disable_nagle_algorithm = True
+
+        def _reply(self, status: int, body: bytes,
+                   content_type: str = 'application/json'):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            self._reply(200, b'ok', 'text/plain')
+
+        def do_POST(self):
+            if latency:
+                time.sleep(latency)
+            if self.path == '/u':
+                return self._upload()
+
+            request = json.loads(
+                self.rfile.read(int(self.headers['Content-Length'])))
+            query = request['query']
+            root = roots['mutation' if query.lstrip().startswith('mutation')
+                         else 'query']
+            response = graphql_sync(schema,
+                                    query,
+                                    root_value=root,
+                                    variable_values=request.get('variables'),
+                                    operation_name=request.get('operationName'))
+            body = {'data': response.data}
+            if response.errors:
+                body['errors'] = [error.formatted for error in response.errors]
+            self._reply(200, json.dumps(body).encode('utf-8'))
+
+        def _upload(self):
+            remaining = int(self.headers['Content-Length'])
+            head = b''
+            while remaining:
+                chunk = self.rfile.read(min(remaining, 1024 * 1024))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                if len(head) < 65536:
+                    head += chunk[:65536]
+                with wiki.lock:
+                    wiki.uploaded_bytes += len(chunk)
+
+            folder = re.search(rb'"folderId":\s*(\d+)', head)
+            filename = re.search(rb'filename="([^"]+)"', head)
+            if folder is None or filename is None:
+                return self._reply(400, b'invalid upload', 'text/plain')
+            with wiki.lock:
+                asset_id = len(wiki.assets) + 1
+                wiki.assets[asset_id] = {
+                    'id': asset_id,
+                    'folderId': int(folder[1]),
+                    'filename': filename[1].decode('utf-8').lower(),
+                    'fileSize': int(self.headers['Content-Length']),
+                }
+            self._reply(200, b'ok', 'text/plain')
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(wiki: StubWiki, port: int = 0,
+          latency: float = 0.0) -> ThreadingHTTPServer:
+    """
+    Starts the stub on a background thread. Every request is delayed by
+    latency seconds to mimic the round trip to a real wikijs.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port),
+                                 make_handler(wiki, latency))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='A stand-in for the GraphQL API and the upload '
+        'endpoint of wikijs.')
+    parser.add_argument('--port', type=int, default=3000)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds every request is delayed by')
+    parser.add_argument('--psql', default=None,
+                        help='connection string of the database to write the '
+                        'pages and the page history to')
+    args = parser.parse_args()
+
+    server = serve(StubWiki(args.psql), args.port, args.latency)
+    print(f'Listening on http://127.0.0.1:{server.server_port}', flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
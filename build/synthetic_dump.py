@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+import argparse
+import io
+import random
+import tarfile
+from datetime import datetime, timedelta, timezone
+from typing import List
+from xml.sax.saxutils import escape
+
+WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do '
+         'eiusmod tempor incididunt ut labore et dolore magna aliqua ut enim '
+         'ad minim veniam quis nostrud exercitation ullamco laboris nisi '
+         'aliquip ex ea commodo consequat').split()
+
+NAMESPACES = ['', 'Help:', 'Projects:', 'Customers:DA:']
+
+
+def page_title(index: int) -> str:
+    return f'{NAMESPACES[index % len(NAMESPACES)]}Page {index}'
+
+
+def image_name(index: int) -> str:
+    return f'Image_{index}.png'
+
+
+class PageGenerator:
+    """
+    Generates the wikitext of synthetic pages. Every page gets paragraphs
+    of filler text up to text_size characters plus the given number of
+    tables, links to other pages, external links and images, so the
+    conversion and the link rewriting see the constructs of a real wiki.
+    """
+
+    def __init__(self,
+                 pages: int,
+                 text_size: int = 2000,
+                 tables: int = 1,
+                 links: int = 5,
+                 images: int = 1,
+                 image_count: int = 50,
+                 seed: int = 0) -> None:
+        self.pages = pages
+        self.text_size = text_size
+        self.tables = tables
+        self.links = links
+        self.images = images
+        self.image_count = image_count
+        self.random = random.Random(seed)
+
+    def sentence(self, words: int = 12) -> str:
+        return ' '.join(self.random.choice(WORDS)
+                        for _ in range(words)).capitalize() + '.'
+
+    def link(self) -> str:
+        kind = self.random.randrange(4)
+        target = page_title(self.random.randrange(self.pages))
+        if kind == 0:
+            return f'[[{target}]]'
+        if kind == 1:
+            return f'[[{target}#Section 1|{self.random.choice(WORDS)}]]'
+        if kind == 2:
+            return (f'[https://example.com/{self.random.randrange(1000)} '
+                    f'{self.random.choice(WORDS)} | {self.random.choice(WORDS)}]')
+        return f'[[Media:{image_name(self.random.randrange(self.image_count))}|download]]'
+
+    def table(self) -> str:
+        columns = self.random.randint(2, 5)
+        rows = [
+            '{| class="wikitable"',
+            '! ' + ' !! '.join(f'Column {i}' for i in range(columns)),
+        ]
+        for _ in range(self.random.randint(2, 8)):
+            rows.append('|-')
+            rows.append('| ' + ' || '.join(
+                self.random.choice(WORDS) for _ in range(columns)))
+        rows.append('|}')
+        return '\n'.join(rows)
+
+    def image(self) -> str:
+        name = image_name(self.random.randrange(self.image_count))
+        return f'[[File:{name}|thumb|{self.sentence(4)}]]'
+
+    def page(self) -> str:
+        blocks: List[str] = []
+        inline = [self.link() for _ in range(self.links)]
+        size = 0
+        section = 1
+        while size < self.text_size:
+            if not blocks or self.random.random() < 0.2:
+                block = f'== Section {section} =='
+                section += 1
+            else:
+                sentences = [self.sentence() for _ in range(4)]
+                if inline:
+                    sentences.insert(self.random.randrange(len(sentences)),
+                                     inline.pop())
+                block = ' '.join(sentences)
+            blocks.append(block)
+            size += len(block)
+        blocks += [' '.join(inline)] if inline else []
+        blocks += [self.table() for _ in range(self.tables)]
+        blocks += [self.image() for _ in range(self.images)]
+        rest = blocks[1:]
+        self.random.shuffle(rest)
+        return '\n\n'.join(blocks[:1] + rest)
+
+    def revise(self, content: str) -> str:
+        return f'{content}\n\n{self.sentence()}'
+
+
+def write_dump(path: str,
+               pages: int,
+               revisions: int = 3,
+               users: int = 10,
+               seed: int = 0,
+               **page_options) -> int:
+    """
+    Writes a mediawiki XML dump with revisions versions of every page and
+    returns the number of written revisions. The pages are generated one
+    by one, so big dumps don't need much memory.
+    """
+    generator = PageGenerator(pages, seed=seed, **page_options)
+    start = datetime(2015, 1, 1, tzinfo=timezone.utc)
+    revision_id = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('<mediawiki xmlns="http://www.mediawiki.org/xml/export-0.10/" '
+                'version="0.10" xml:lang="en">\n'
+                '<siteinfo><sitename>Synthetic</sitename></siteinfo>\n')
+        for page in range(pages):
+            f.write(f'<page><title>{escape(page_title(page))}</title>'
+                    f'<ns>0</ns><id>{page + 1}</id>\n')
+            content = generator.page()
+            timestamp = start + timedelta(minutes=page)
+            for revision in range(revisions):
+                if revision:
+                    content = generator.revise(content)
+                    timestamp += timedelta(
+                        hours=generator.random.randint(1, 1000))
+                revision_id += 1
+                user = generator.random.randrange(users)
+                f.write(
+                    f'<revision><id>{revision_id}</id>'
+                    f'<timestamp>{timestamp.strftime("%Y-%m-%dT%H:%M:%SZ")}'
+                    f'</timestamp><contributor><username>User {user}'
+                    f'</username><id>{user + 1}</id></contributor>'
+                    f'<text xml:space="preserve">{escape(content)}</text>'
+                    f'</revision>\n')
+            f.write('</page>\n')
+        f.write('</mediawiki>\n')
+    return revision_id
+
+
+def write_asset_archive(path: str,
+                        count: int = 50,
+                        size: int = 64 * 1024,
+                        seed: int = 0) -> int:
+    """
+    Writes a tar archive laid out like the images directory of mediawiki,
+    including the archive and deleted directories the migration skips.
+    Returns the number of bytes of the files that are migrated.
+    """
+    rnd = random.Random(seed)
+    total = 0
+    with tarfile.open(path, 'w') as archive:
+
+        def add(name: str, data: bytes):
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+
+        for index in range(count):
+            data = rnd.randbytes(rnd.randint(size // 2, size * 3 // 2))
+            add(f'./{index % 16:x}/{index % 256:02x}/{image_name(index)}',
+                data)
+            total += len(data)
+            if index % 10 == 0:
+                add(f'./archive/{index % 16:x}/{index % 256:02x}/'
+                    f'20200101000000!{image_name(index)}', data[:1024])
+        add('./deleted/0/00/old.png', b'deleted')
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Generates a synthetic mediawiki dump and asset archive.')
+    parser.add_argument('dump')
+    parser.add_argument('--assets', default=None,
+                        help='also write an asset archive to this path')
+    parser.add_argument('--pages', type=int, default=1000)
+    parser.add_argument('--revisions', type=int, default=3)
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--text-size', type=int, default=2000)
+    parser.add_argument('--tables', type=int, default=1)
+    parser.add_argument('--links', type=int, default=5)
+    parser.add_argument('--images', type=int, default=1)
+    parser.add_argument('--image-count', type=int, default=50)
+    parser.add_argument('--image-size', type=int, default=64 * 1024)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    revisions = write_dump(args.dump, args.pages, args.revisions, args.users,
+                           args.seed, text_size=args.text_size,
+                           tables=args.tables, links=args.links,
+                           images=args.images, image_count=args.image_count)
+    print(f'Wrote {args.pages} pages with {revisions} revisions.')
+    if args.assets:
+        size = write_asset_archive(args.assets, args.image_count,
+                                   args.image_size, args.seed)
+        print(f'Wrote {args.image_count} assets with {size} bytes.')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,26 @@
 #!/usr/bin/env python3
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import time
 import unittest
+from collections import namedtuple
 import fix_links
+import converter
+import graphql_batch
+import asset_pipeline
+from conversion_cache import ConversionCache
+from dump_store import DumpStore
+from history_writer import HistoryWriter
+from journal import MigrationJournal
+from metrics import Metrics, Progress
+import synthetic_dump
+from mediawiki_dump.dumps import LocalFileDump
+from mediawiki_dump.reader import DumpReader
+
+Entry = namedtuple('Entry', ['title', 'content', 'contributor', 'timestamp'])
 
 class Tests(unittest.TestCase):
     def test_html_link(self):
@@ -29,5 +49,295 @@ class Tests(unittest.TestCase):
 
         self.assertEqual(converted_content, '![Aufnahme der Einstellung](/assets/gatewaypowermng.jpg "Aufnahme der Einstellung")')
 
+    def test_multiple_links_per_line(self):
+        input_str = '[Bild](Media:Plan.PNG "wikilink") und [Seite](Help:Start#Oben "wikilink")'
+        converted_content = fix_links.fix_hyper_links(input_str)
+
+        self.assertEqual(converted_content,
+                         '[Bild](/assets/plan.png "Bild") und [Seite](/Help/Start#oben "Seite")')
+
+    def test_long_line_runs_in_linear_time(self):
+        links = ' | '.join(['[x](http://h/y)', '<a href="x">', '[[[[',
+                            '[Seite](Help:Start#Oben "wikilink")'] * 2000)
+        links += '\n' + ' '.join(['![a](b "t'] * 2000)
+        links += '\n' + ' '.join(['\\<img src="a" title="b"'] * 3000)
+        links += '\n' + ' '.join(['<img src="a" title="b"', '<a href="x"'] * 5000)
+        started = time.perf_counter()
+        converted_content = fix_links.fix_hyper_links(links)
+
+        self.assertLess(time.perf_counter() - started, 1)
+        self.assertEqual(converted_content.count('(/Help/Start#oben "Seite")'), 2000)
+
+    def test_batch(self):
+        self.assertEqual(fix_links.fix_hyper_links_many(['[a](b "wikilink")', 'text']),
+                         ['[a](/b "a")', 'text'])
+
+    def test_strip_link_pipes(self):
+        input_str = ('[[Page|Text]] [http://host/x Label | more]\n'
+                     '| cell | cell |\n'
+                     'x [a|b] y [c | d] [[e|f]]')
+        self.assertEqual(fix_links.strip_link_pipes(input_str),
+                         '[[Page|Text]] [http://host/x Label more]\n'
+                         '| cell | cell |\n'
+                         'x [a|b] y [c d] [[e|f]]')
+
+class DumpStoreTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.tmpdir.name, 'wiki.xml')
+        with open(self.source, 'w') as f:
+            f.write('<mediawiki/>')
+        self.store = DumpStore(os.path.join(self.tmpdir.name, 'index.sqlite'),
+                               os.path.join(self.tmpdir.name, 'revisions.bin'))
+        self.store.build([
+            Entry('Help:Start page', 'second', 'bob', '2020-01-02T00:00:00Z'),
+            Entry('Main', 'only', 'alice', '2019-05-01T00:00:00Z'),
+            Entry('Help:Start page', 'first', 'alice', '2020-01-01T00:00:00Z'),
+        ], self.source)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_pages_grouped_and_sorted(self):
+        pages = list(self.store.pages())
+
+        self.assertEqual([path for path, _ in pages], ['Main', 'Help/Start_page'])
+        path, data = pages[1]
+        self.assertEqual(data.title, 'Start page')
+        self.assertEqual([entry.content for entry in data], ['first', 'second'])
+        self.assertEqual([entry.contributor for entry in data], ['alice', 'bob'])
+
+    def test_contributors(self):
+        self.assertEqual(self.store.contributors(), {'alice', 'bob'})
+
+    def test_rebuild_on_changed_source(self):
+        self.assertTrue(self.store.is_built_from(self.source))
+        with open(self.source, 'a') as f:
+            f.write('\n')
+        self.assertFalse(self.store.is_built_from(self.source))
+
+class ConverterTests(unittest.TestCase):
+    def test_split_batch_output(self):
+        output = 'first\n\n## MARK\n\n## MARK\n\nthird\n\n## MARK\n'
+        parts = converter.split_batch_output(output, 'MARK', 3)
+
+        self.assertEqual(parts, ['first\n', '\n', 'third\n'])
+
+    def test_split_batch_output_rejects_swallowed_marker(self):
+        output = 'first\n\n## MARK\n\n    == MARK ==\n'
+        self.assertIsNone(converter.split_batch_output(output, 'MARK', 2))
+
+    @unittest.skipUnless(shutil.which('pandoc'), 'pandoc is not installed')
+    def test_batch_matches_single_conversion(self):
+        contents = [
+            "== Heading ==\n* one\n* two",
+            "{| class=\"wikitable\"\n|-\n| a || b\n|}",
+            "",
+            "<pre>\nunclosed",
+            "Text with a [[Link|label]] and '''bold'''",
+        ]
+        engine = converter.ContentConverter(workers=2, batch_size=10)
+
+        self.assertEqual(engine.convert_batch(contents),
+                         [converter.convert_document(c) for c in contents])
+
+class ConversionCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_roundtrip_and_version(self):
+        cache = ConversionCache(self.tmpdir.name, 1024 * 1024, '1')
+        cache.put("'''bold'''", '**bold**\n')
+
+        self.assertEqual(cache.get("'''bold'''"), '**bold**\n')
+        self.assertIsNone(cache.get("''italic''"))
+        self.assertIsNone(
+            ConversionCache(self.tmpdir.name, 1024 * 1024, '2').get("'''bold'''"))
+
+    def test_eviction(self):
+        cache = ConversionCache(self.tmpdir.name, 4096, '1')
+        for i in range(20):
+            cache.put(str(i), os.urandom(512).hex())
+
+        cached = [i for i in range(20) if cache.get(str(i)) is not None]
+        self.assertLessEqual(cache._size, 4096)
+        self.assertTrue(0 < len(cached) < 20)
+
+    def test_eviction_skips_files_being_written(self):
+        cache = ConversionCache(self.tmpdir.name, 4096, '1')
+        tmp_path = os.path.join(self.tmpdir.name, 'ab', 'ab12.1.tmp')
+        os.makedirs(os.path.dirname(tmp_path))
+        with open(tmp_path, 'wb') as f:
+            f.write(os.urandom(8192))
+        for i in range(20):
+            cache.put(str(i), os.urandom(512).hex())
+
+        self.assertTrue(os.path.exists(tmp_path))
+
+class GraphQLBatchTests(unittest.TestCase):
+    def test_build_document(self):
+        document = graphql_batch.build_document('mutation', [
+            'pages{render(id: 1){responseResult{errorCode}}}',
+            'pages{render(id: 2){responseResult{errorCode}}}',
+        ])
+
+        self.assertEqual(document,
+                         'mutation{op0: pages{render(id: 1){responseResult{errorCode}}} '
+                         'op1: pages{render(id: 2){responseResult{errorCode}}}}')
+
+    def test_succeeded(self):
+        self.assertTrue(graphql_batch.succeeded(
+            {'render': {'responseResult': {'errorCode': 0}}}, 'render'))
+        self.assertFalse(graphql_batch.succeeded(
+            {'render': {'responseResult': {'errorCode': 6003}}}, 'render'))
+        self.assertFalse(graphql_batch.succeeded({'render': None}, 'render'))
+        self.assertFalse(graphql_batch.succeeded({}, 'render'))
+        self.assertFalse(graphql_batch.succeeded(None, 'render'))
+
+    def test_failed_request_fails_every_operation(self):
+        batcher = graphql_batch.GraphQLBatcher('http://127.0.0.1:1/graphql', '',
+                                               batch_size=2, timeout=5)
+
+        with self.assertLogs('graphql_batch', 'ERROR'):
+            results = batcher.execute_many('mutation', ['a', 'b', 'c'])
+
+        self.assertEqual(results, [None, None, None])
+
+class HistoryWriterTests(unittest.TestCase):
+    def test_build_rows(self):
+        writer = HistoryWriter(None, {'alice': 1, 'bob': 2})
+        writer.add_page(7, [
+            ('2020-01-01T00:00:00Z', 'alice'),
+            ('2020-01-02T00:00:00Z', 'bob'),
+            ('2020-01-03T00:00:00Z', 'carol'),
+        ])
+        writer.add_updated_date(7, '2020-01-03T00:00:00Z')
+        writer.add_updated_date(8, '2021-01-01T00:00:00Z')
+
+        history_rows, page_rows = writer.build_rows({7: [12, 11]})
+
+        self.assertEqual(history_rows, [(11, '2020-01-01T00:00:00Z', 1),
+                                        (12, '2020-01-02T00:00:00Z', 2)])
+        self.assertEqual(page_rows, [
+            (7, '2020-01-01T00:00:00Z', 1, None, '2020-01-03T00:00:00Z'),
+            (8, None, None, None, '2021-01-01T00:00:00Z'),
+        ])
+
+class AssetPipelineTests(unittest.TestCase):
+    def test_buffer_small_file_in_memory(self):
+        body = asset_pipeline.buffer_file(io.BytesIO(b'small'), 5, 1024)
+        self.assertEqual(body, b'small')
+
+    def test_buffer_big_file_on_disk(self):
+        body = asset_pipeline.buffer_file(io.BytesIO(b'x' * 2048), 2048, 1024)
+        self.assertNotIsInstance(body, bytes)
+        self.assertEqual(body.read(), b'x' * 2048)
+        body.close()
+
+class JournalTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.journal = MigrationJournal(
+            os.path.join(self.tmpdir.name, 'journal.sqlite'))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_revisions_and_steps(self):
+        self.journal.revision_pushed('A', 3, 0, '2020-01-01T00:00:00Z', 'alice', 'h1')
+        self.journal.revision_skipped('A', 1, '2020-01-03T00:00:00Z')
+        self.journal.revision_pushed('A', 3, 2, '2020-01-03T00:00:00Z', 'bob', 'h2')
+
+        state = self.journal.page('A')
+        self.assertEqual(state.page_id, 3)
+        self.assertEqual(state.processed, 3)
+        self.assertEqual(state.last_timestamp, '2020-01-03T00:00:00Z')
+        self.assertEqual(state.last_md_hash, 'h2')
+        self.assertEqual(self.journal.revisions('A'),
+                         [('2020-01-01T00:00:00Z', 'alice'),
+                          ('2020-01-03T00:00:00Z', 'bob')])
+        self.assertEqual(self.journal.pending('rendered'),
+                         [('A', 3, '2020-01-03T00:00:00Z')])
+
+        self.journal.mark('rendered', [3])
+        self.assertEqual(self.journal.pending('rendered'), [])
+        self.assertFalse(self.journal.page('A').finished)
+
+    def test_skipped_revisions_count_as_processed(self):
+        self.journal.revision_skipped('B', 0, '2020-01-01T00:00:00Z')
+
+        state = self.journal.page('B')
+        self.assertIsNone(state.page_id)
+        self.assertEqual(state.processed, 1)
+        self.assertEqual(self.journal.revisions('B'), [])
+        self.assertEqual(self.journal.pending('history_fixed'), [])
+
+    def test_stages(self):
+        self.assertFalse(self.journal.stage_done('assets'))
+        self.journal.finish_stage('assets')
+        self.assertTrue(self.journal.stage_done('assets'))
+
+class MetricsTests(unittest.TestCase):
+    def test_timed_and_counters(self):
+        metrics = Metrics()
+        metrics.observe('graphql', 0.003)
+        metrics.observe('graphql', 2)
+        with self.assertRaises(ValueError), metrics.timed('graphql'):
+            raise ValueError()
+        metrics.count('graphql_bytes_sent', 100)
+
+        stage = metrics.to_dict()['stages']['graphql']
+        self.assertEqual(stage['count'], 3)
+        self.assertEqual(stage['max'], 2)
+        self.assertEqual(stage['buckets']['0.005'], 2)
+        self.assertEqual(stage['buckets']['+Inf'], 3)
+        self.assertEqual(metrics.to_dict()['counters'],
+                         {'graphql_errors': 1, 'graphql_bytes_sent': 100})
+
+        prometheus = metrics.prometheus().splitlines()
+        self.assertIn('mw2wjs_graphql_bytes_sent_total 100', prometheus)
+        self.assertIn('mw2wjs_stage_seconds_bucket{stage="graphql",le="5"} 3', prometheus)
+        self.assertIn('mw2wjs_stage_seconds_count{stage="graphql"} 3', prometheus)
+
+    def test_progress(self):
+        progress = Progress(10, interval=3600)
+        progress.started -= 10
+        progress.advance(pages=5, revisions=20)
+
+        self.assertEqual(progress.status(progress.started + 10),
+                         'Migrated 5/10 pages and 20 revisions '
+                         '(0.50 pages/s, 2.00 revisions/s), ETA 0:00:10.')
+
+class SyntheticDumpTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_dump_is_readable(self):
+        path = os.path.join(self.tmpdir.name, 'wiki.xml')
+        revisions = synthetic_dump.write_dump(path, 4, revisions=3, text_size=200)
+        entries = list(DumpReader().read(LocalFileDump(path)))
+
+        self.assertEqual(revisions, 12)
+        self.assertEqual(len(entries), 12)
+        self.assertEqual(entries[0].title, 'Page 0')
+        self.assertIn('{| class="wikitable"', entries[0].content)
+        self.assertTrue(entries[2].content.startswith(entries[1].content))
+
+    def test_asset_archive(self):
+        path = os.path.join(self.tmpdir.name, 'assets.tar')
+        size = synthetic_dump.write_asset_archive(path, count=5, size=1024)
+
+        with tarfile.open(path) as archive:
+            members = [m for m in archive.getmembers()
+                       if 'archive' not in m.name and 'deleted' not in m.name]
+        self.assertEqual(len(members), 5)
+        self.assertEqual(sum(m.size for m in members), size)
+
 if __name__ == "__main__":
     unittest.main()